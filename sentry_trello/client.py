@@ -1,19 +1,687 @@
 from __future__ import absolute_import
 
+import logging
+import random
+import six
+import threading
+import time
+import zlib
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from hashlib import md5
+from itertools import islice
+from multiprocessing.pool import ThreadPool
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache as django_cache
+from django.db import connection
+from requests.exceptions import HTTPError, RequestException
+from requests.packages.urllib3.util.retry import Retry
 from sentry import http
-from sentry.utils import json
+from sentry.utils import json, metrics
+
+from .records import to_records
+from .search import search_indexes
+
+try:
+    import ujson as fast_json
+except ImportError:
+    fast_json = None
+
+logger = logging.getLogger('sentry.plugins.trello')
+
+
+def decode_json(content):
+    """
+    Decode a JSON response body, with ujson when it is installed.
+    """
+    if fast_json is not None:
+        return fast_json.loads(content)
+    return json.loads(content)
+
+
+def _setting(name, default):
+    return getattr(settings, 'SENTRY_TRELLO_%s' % name, default)
+
+
+class SessionPool(object):
+    """
+    Keep-alive HTTP sessions shared across requests and threads, keyed by
+    API key and token. Sessions idle for longer than ``idle_timeout`` seconds
+    are closed and evicted on the next checkout.
+    """
+
+    def __init__(self, pool_size=None, idle_timeout=None, max_retries=None):
+        if pool_size is None:
+            pool_size = _setting('POOL_SIZE', 10)
+        if idle_timeout is None:
+            idle_timeout = _setting('POOL_IDLE_TIMEOUT', 300)
+        if max_retries is None:
+            max_retries = _setting('MAX_RETRIES', 2)
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.max_retries = max_retries
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def _build_session(self):
+        session = http.build_session()
+        # reuse whichever adapter class sentry mounted (it enforces the
+        # outbound IP blacklist) but with a larger pool and retries
+        adapter_cls = type(session.get_adapter('https://'))
+        retries = Retry(
+            total=self.max_retries,
+            backoff_factor=0.1,
+            status_forcelist=(502, 503, 504),
+        )
+        for prefix in ('https://', 'http://'):
+            session.mount(prefix, adapter_cls(
+                pool_connections=self.pool_size,
+                pool_maxsize=self.pool_size,
+                max_retries=retries,
+            ))
+        return session
+
+    def _evict_idle(self, now):
+        for key, (session, last_used) in list(self._sessions.items()):
+            if now - last_used > self.idle_timeout:
+                del self._sessions[key]
+                session.close()
+
+    def get(self, apikey, token):
+        key = (apikey, token)
+        now = time.time()
+        with self._lock:
+            self._evict_idle(now)
+            if key in self._sessions:
+                session = self._sessions[key][0]
+            else:
+                session = self._build_session()
+            self._sessions[key] = (session, now)
+        return session
+
+    def clear(self):
+        with self._lock:
+            for session, _ in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+
+_session_pool = None
+_session_pool_lock = threading.Lock()
+
+
+def get_session_pool():
+    global _session_pool
+    if _session_pool is None:
+        with _session_pool_lock:
+            if _session_pool is None:
+                _session_pool = SessionPool()
+    return _session_pool
+
+
+class TokenBucket(object):
+    """
+    Trello allows roughly ``capacity`` requests every ``period`` seconds per
+    key/token. Callers reserve a token and are told how long to wait for it,
+    so concurrent callers queue up instead of all hitting a 429.
+    """
+
+    def __init__(self, capacity, period):
+        self.capacity = float(capacity)
+        self.rate = self.capacity / period
+        self._tokens = self.capacity
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        with self._lock:
+            now = time.time()
+            self._tokens = min(
+                self.capacity,
+                self._tokens + (now - self._updated) * self.rate,
+            )
+            self._updated = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+
+class RateLimiter(object):
+    def __init__(self, capacity=None, period=None):
+        if capacity is None:
+            capacity = _setting('RATE_LIMIT', 100)
+        if period is None:
+            period = _setting('RATE_LIMIT_PERIOD', 10)
+        self.capacity = capacity
+        self.period = period
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, apikey, token):
+        """
+        Block until a request may be sent and return the seconds waited.
+        """
+        key = (apikey, token)
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(
+                    self.capacity, self.period)
+        delay = bucket.reserve()
+        if delay:
+            time.sleep(delay)
+        return delay
+
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    global _rate_limiter
+    if _rate_limiter is None:
+        with _rate_limiter_lock:
+            if _rate_limiter is None:
+                _rate_limiter = RateLimiter()
+    return _rate_limiter
+
+
+def backoff_delay(attempt, retry_after=None, base=0.5, cap=10.0):
+    """
+    Exponential backoff with full jitter, honouring ``Retry-After`` when
+    Trello sends one.
+    """
+    if retry_after:
+        try:
+            return min(cap, float(retry_after))
+        except ValueError:
+            pass
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class CircuitOpenError(RequestException):
+    """
+    Raised instead of calling Trello while the circuit for an endpoint is open.
+    """
+
+
+class CircuitBreaker(object):
+    """
+    Fail fast after ``threshold`` consecutive failures. Once ``reset_timeout``
+    seconds pass a single probe request is let through (half-open); it closes
+    the circuit on success and re-opens it on failure.
+    """
+
+    def __init__(self, threshold=None, reset_timeout=None):
+        if threshold is None:
+            threshold = _setting('CIRCUIT_THRESHOLD', 5)
+        if reset_timeout is None:
+            reset_timeout = _setting('CIRCUIT_RESET_TIMEOUT', 30)
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if self._probing or time.time() - self._opened_at < self.reset_timeout:
+                raise CircuitOpenError('Trello is unavailable, try again later.')
+            self._probing = True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.threshold:
+                self._opened_at = time.time()
+            self._probing = False
+
+
+_circuit_breakers = {}
+_circuit_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(endpoint):
+    with _circuit_breakers_lock:
+        breaker = _circuit_breakers.get(endpoint)
+        if breaker is None:
+            breaker = _circuit_breakers[endpoint] = CircuitBreaker()
+        return breaker
+
+
+class RequestTracker(object):
+    """
+    Collects the Trello calls made while it is active on the current thread.
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    @property
+    def count(self):
+        return len(self.calls)
+
+    @property
+    def duration(self):
+        return sum(c['duration'] for c in self.calls)
+
+
+_tracking = threading.local()
+
+
+@contextmanager
+def track_requests():
+    previous = getattr(_tracking, 'tracker', None)
+    tracker = _tracking.tracker = RequestTracker()
+    try:
+        yield tracker
+    finally:
+        _tracking.tracker = previous
+
+
+def record_metrics(stats):
+    tags = {'endpoint': stats['endpoint'], 'status': stats['status']}
+    metrics.timing('trello.request.duration', stats['duration'], tags=tags)
+    metrics.timing('trello.request.size', stats['size'], tags=tags)
+    metrics.timing('trello.request.rate_limit_wait', stats['rate_limit_wait'], tags=tags)
+    if stats['retries']:
+        metrics.incr('trello.request.retries', stats['retries'], tags=tags)
+
+
+class _Flight(object):
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """
+    Coalesce identical concurrent calls: while one caller is running ``fn``
+    for a key, other callers with the same key wait for and share its
+    result (or exception) instead of issuing their own request.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = fn()
+        except Exception as exc:
+            flight.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.event.set()
+        return flight.result
+
+
+_single_flight = SingleFlight()
+
+
+def get_single_flight():
+    return _single_flight
+
+
+class LocalCache(object):
+    """
+    In-process cache with a per-entry TTL and least-recently-used eviction
+    once ``max_size`` entries are stored.
+    """
+
+    def __init__(self, ttl=None, max_size=None):
+        if ttl is None:
+            ttl = _setting('CACHE_TTL', 600)
+        if max_size is None:
+            max_size = _setting('CACHE_MAX_SIZE', 1000)
+        self.ttl = ttl
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.pop(key, None)
+            if item is None:
+                return None
+            value, expires = item
+            if expires < time.time():
+                return None
+            # re-insert to mark as most recently used
+            self._data[key] = item
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, expires)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class DjangoCache(object):
+    """
+    Stores entries in Django's cache backend so every web node shares them.
+    """
+
+    def __init__(self, ttl=None, backend=None):
+        if ttl is None:
+            ttl = _setting('CACHE_TTL', 600)
+        self.ttl = ttl
+        self._backend = backend or django_cache
+
+    def get(self, key):
+        return self._backend.get(key)
+
+    def set(self, key, value, ttl=None):
+        self._backend.set(key, value, self.ttl if ttl is None else ttl)
+
+    def delete(self, key):
+        self._backend.delete(key)
+
+    def clear(self):
+        """
+        Does nothing: the backend is shared with the rest of Sentry, so it
+        cannot be flushed for Trello alone. Entries expire with their TTL.
+        """
+
+
+_metadata_cache = None
+_metadata_cache_lock = threading.Lock()
+
+
+def get_metadata_cache():
+    global _metadata_cache
+    if _metadata_cache is None:
+        with _metadata_cache_lock:
+            if _metadata_cache is None:
+                if _setting('CACHE_BACKEND', 'local') == 'django':
+                    _metadata_cache = DjangoCache()
+                else:
+                    _metadata_cache = LocalCache()
+    return _metadata_cache
+
+
+def _is_rejection(exc):
+    """
+    Whether ``exc`` is a 4xx response from Trello other than throttling.
+    """
+    response = getattr(exc, 'response', None)
+    if response is None:
+        return False
+    return 400 <= response.status_code < 500 and response.status_code != 429
+
+
+def token_fingerprint(apikey, token):
+    return md5('%s:%s' % (apikey, token)).hexdigest()
+
+
+_executor = None
+_executor_lock = threading.Lock()
+_worker = threading.local()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPool(_setting('CONCURRENCY', 8))
+    return _executor
+
+
+def _run_in_worker(fn, tracker):
+    # carry the caller's request tracker over to the worker thread
+    _worker.active = True
+    _tracking.tracker = tracker
+    try:
+        return fn()
+    finally:
+        _tracking.tracker = None
+        _worker.active = False
+        # Django only closes the request thread's connection, so one opened
+        # here (e.g. to read plugin options) would otherwise stay open and
+        # go stale in the idle pool thread
+        connection.close()
+
+
+class _ImmediateResult(object):
+    def __init__(self, fn):
+        self._value = self._error = None
+        try:
+            self._value = fn()
+        except Exception as exc:
+            self._error = exc
+
+    def get(self, timeout=None):
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+
+def submit(fn):
+    """
+    Run ``fn`` on the shared thread pool and return an object whose
+    ``get()`` returns its result or raises its exception. Calls made from a
+    pool thread run inline so nested fan-out cannot exhaust the pool.
+    """
+    if getattr(_worker, 'active', False):
+        return _ImmediateResult(fn)
+    tracker = getattr(_tracking, 'tracker', None)
+    return get_executor().apply_async(_run_in_worker, (fn, tracker))
+
+
+def run_concurrently(calls):
+    """
+    Run zero-argument callables concurrently and return their results in
+    order, raising the first exception encountered.
+    """
+    return [r.get() for r in [submit(fn) for fn in calls]]
+
+
+class Revalidator(object):
+    """
+    Refresh expired cache entries on the shared thread pool, running at most
+    one refresh per key at a time.
+    """
+
+    def __init__(self):
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def schedule(self, key, fn):
+        """
+        Queue ``fn`` unless a refresh of ``key`` is already pending. Returns
+        whether it was queued.
+        """
+        with self._lock:
+            if key in self._pending:
+                return False
+            self._pending.add(key)
+
+        def run():
+            try:
+                fn()
+            except Exception:
+                logger.warning('trello.revalidate-failed', exc_info=True)
+            finally:
+                with self._lock:
+                    self._pending.discard(key)
+
+        # background refreshes are not part of the caller's request count
+        get_executor().apply_async(_run_in_worker, (run, None))
+        return True
+
+
+_revalidator = Revalidator()
+
+
+def get_revalidator():
+    return _revalidator
+
+
+def _to_bytes(chunk):
+    if isinstance(chunk, six.text_type):
+        return chunk.encode('utf-8')
+    return chunk
+
+
+def iter_gzip(chunks, level=6):
+    """
+    Gzip an iterable of chunks incrementally.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        out = compressor.compress(_to_bytes(chunk))
+        if out:
+            yield out
+    yield compressor.flush()
+
+
+def iter_multipart(boundary, field, filename, chunks, mime_type=None):
+    """
+    Wrap an iterable of chunks in a single-file multipart/form-data body.
+    """
+    yield _to_bytes(
+        '--%s\r\n'
+        'Content-Disposition: form-data; name="%s"; filename="%s"\r\n'
+        'Content-Type: %s\r\n\r\n' % (
+            boundary, field, filename.replace('"', ''),
+            mime_type or 'application/octet-stream',
+        )
+    )
+    for chunk in chunks:
+        yield _to_bytes(chunk)
+    yield _to_bytes('\r\n--%s--\r\n' % boundary)
+
+
+def _field_keys(fields):
+    """
+    Record keys for a comma separated Trello ``fields`` parameter; Trello
+    always includes the id.
+    """
+    if not fields or fields == 'all':
+        return None
+    return ('id',) + tuple(f for f in fields.split(',') if f != 'id')
 
 
 class TrelloClient(object):
     base_url = 'https://trello.com/1/'
 
-    def __init__(self, apikey, token=None, timeout=5):
+    # maximum number of routes in a single /batch request
+    batch_limit = 10
+
+    # minimum age in seconds of cached board names before a lookup miss
+    # triggers a refetch
+    names_refresh_interval = 60
+
+    max_throttle_retries = 3
+
+    def __init__(self, apikey, token=None, timeout=5, session_pool=None,
+                 cache=None, rate_limiter=None, on_request=record_metrics):
+        self.stale_ttl = _setting('CACHE_STALE_TTL', 86400)
+        # serve expired entries right away and refresh them in the background
+        self.revalidate = _setting('CACHE_REVALIDATE', True)
+        # called with a dict of timing, status, size, retries and rate limit
+        # wait for every request sent to Trello
+        self.on_request = on_request
         self._apikey = apikey
         self._token = token
         self._timeout = timeout
+        self._session_pool = session_pool or get_session_pool()
+        self._cache = cache or get_metadata_cache()
+        self._rate_limiter = rate_limiter or get_rate_limiter()
+        # total seconds this client spent waiting on the rate limiter
+        # and on 429 backoff
+        self.rate_limit_wait = 0.0
+
+    def _cache_key(self, *parts):
+        return 'trello:%s:%s' % (
+            token_fingerprint(self._apikey, self._token),
+            ':'.join('%s' % (p,) for p in parts),
+        )
+
+    def _cached(self, key, fetch, refresh=False):
+        """
+        Return a cached result younger than the cache TTL, otherwise fetch it.
+        Entries are kept for ``stale_ttl`` seconds longer so they can still be
+        served while Trello is failing or the circuit is open. With
+        ``revalidate`` an expired entry is returned at once and refreshed in
+        the background.
+        """
+        entry = self._cache.get(key)
+        if entry is not None and not refresh:
+            result, fetched_at = entry
+            if time.time() - fetched_at < self._cache.ttl:
+                return result
+            if self.revalidate:
+                get_revalidator().schedule(
+                    key, lambda: self._cached(key, fetch, refresh=True))
+                return result
+        try:
+            result = fetch()
+        except RequestException as exc:
+            # Trello rejecting the request (e.g. a revoked token) is an
+            # answer, not an outage, so the old entry is dropped
+            if _is_rejection(exc):
+                self._cache.delete(key)
+            elif entry is not None:
+                return entry[0]
+            raise
+        self._cache.set(
+            key, (result, time.time()), ttl=self._cache.ttl + self.stale_ttl)
+        return result
 
-    def _request(self, path, method="GET", params=None, data=None):
+    def _request(self, path, method="GET", params=None, data=None,
+                 endpoint=None, body=None, headers=None, keys=None):
+        """
+        ``body`` may be a callable returning an iterable of bytes; it is
+        called for each attempt so streamed uploads can be retried. With
+        ``keys`` (see ``records.to_records``) only those fields of the
+        response are kept, as records rather than dicts.
+        """
         path = path.lstrip('/')
+        if endpoint is None:
+            endpoint = path.split('/', 1)[0]
         url = self.base_url + path
 
         if not params:
@@ -22,74 +690,444 @@ class TrelloClient(object):
         params.setdefault('key', self._apikey)
         params.setdefault('token', self._token)
 
-        session = http.build_session()
-        resp = getattr(session, method.lower())(
-            url,
-            params=params,
-            json=data,
-            timeout=self._timeout,
-        )
+        kwargs = {
+            'params': params,
+            'json': data,
+            'headers': headers,
+        }
+        if method.upper() == 'GET':
+            flight_key = (url, keys, tuple(sorted(
+                (k, v) for k, v in params.items() if v is not None
+            )))
+            return get_single_flight().do(
+                flight_key,
+                lambda: self._send(url, method, path, endpoint, kwargs, keys=keys),
+            )
+        return self._send(url, method, path, endpoint, kwargs, body, keys)
+
+    def _send(self, url, method, path, endpoint, kwargs, body=None, keys=None):
+        # circuits are tracked per endpoint class (boards, cards, ...)
+        breaker = get_circuit_breaker(path.split('/', 1)[0])
+        breaker.before_call()
+        session = self._session_pool.get(self._apikey, self._token)
+        attempt = 0
+        wait = 0.0
+        start = time.time()
+        resp = None
+        try:
+            while True:
+                wait += self._rate_limiter.acquire(self._apikey, self._token)
+                if body is not None:
+                    kwargs['data'] = body()
+                resp = getattr(session, method.lower())(
+                    url,
+                    timeout=self._timeout,
+                    **kwargs
+                )
+                if resp.status_code != 429 or attempt >= self.max_throttle_retries:
+                    break
+                delay = backoff_delay(attempt, resp.headers.get('Retry-After'))
+                time.sleep(delay)
+                wait += delay
+                attempt += 1
+        except Exception:
+            # any error must release a half-open probe, or the circuit
+            # would stay open for good
+            breaker.record_failure()
+            raise
+        finally:
+            self.rate_limit_wait += wait
+            self._record(endpoint, resp, time.time() - start, attempt, wait)
+        if resp.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
         resp.raise_for_status()
-        return json.loads(resp.content)
+        result = decode_json(resp.content)
+        if keys is not None:
+            result = to_records(result, keys)
+        return result
+
+    def _record(self, endpoint, resp, duration, retries, wait):
+        stats = {
+            'endpoint': endpoint,
+            'status': resp.status_code if resp is not None else 'error',
+            'size': len(resp.content) if resp is not None else 0,
+            'duration': duration,
+            'retries': retries,
+            'rate_limit_wait': wait,
+        }
+        tracker = getattr(_tracking, 'tracker', None)
+        if tracker is not None:
+            tracker.calls.append(stats)
+        if self.on_request is not None:
+            self.on_request(stats)
+
+    def check_credentials(self, refresh=False):
+        """
+        Return whether Trello accepts the key and token. Accepted
+        credentials are cached per key/token fingerprint.
+        """
+        try:
+            self._cached(
+                self._cache_key('credentials'),
+                lambda: bool(self._request(
+                    path='/members/me',
+                    endpoint='member.me',
+                    params={'fields': 'id'},
+                    keys=('id',),
+                )),
+                refresh=refresh,
+            )
+        except HTTPError as exc:
+            if exc.response is not None and exc.response.status_code == 401:
+                return False
+            raise
+        return True
 
-    def get_organization_boards(self, org_id_or_name, fields=None):
+    def get_organization_boards(self, org_id_or_name, fields='name', refresh=False):
+        return self._cached(
+            self._cache_key('organization_boards', org_id_or_name, fields),
+            lambda: self._request(
+                path='/organizations/%s/boards' % (org_id_or_name),
+                endpoint='organization.boards',
+                params={
+                    'fields': fields,
+                },
+                keys=_field_keys(fields),
+            ),
+            refresh=refresh,
+        )
+
+    def get_organization_list(self, member_id_or_username, fields='name', refresh=False):
+        return self._cached(
+            self._cache_key('organization_list', member_id_or_username, fields),
+            lambda: self._request(
+                path='/members/%s/organizations' % (member_id_or_username),
+                endpoint='member.organizations',
+                params={
+                    'fields': fields,
+                },
+                keys=_field_keys(fields),
+            ),
+            refresh=refresh,
+        )
+
+    def get_board_list(self, board_id, fields='name', refresh=False):
+        return self._cached(
+            self._cache_key('board_list', board_id, fields),
+            lambda: self._request(
+                path='/boards/%s/lists' % (board_id),
+                endpoint='board.lists',
+                params={
+                    'fields': fields,
+                },
+                keys=_field_keys(fields),
+            ),
+            refresh=refresh,
+        )
+
+    def new_card(self, name, idList, desc=None, pos=None, idLabels=None,
+                 idMembers=None, due=None):
+        data = {
+            'name': name,
+            'idList': idList,
+            'desc': desc,
+            'pos': pos,
+            'idLabels': idLabels,
+            'idMembers': idMembers,
+            'due': due,
+        }
+        for key in ('idLabels', 'idMembers'):
+            if isinstance(data[key], (list, tuple)):
+                data[key] = ','.join(data[key])
         return self._request(
-            path='/organizations/%s/boards' % (org_id_or_name),
-            params={
-                'fields': fields,
-            },
+            path='/cards',
+            endpoint='cards.create',
+            method='POST',
+            data=dict((k, v) for k, v in data.items() if v),
+            # Trello always returns the whole card, keep what callers use
+            keys=('id', 'url'),
+        )
+
+    def get_boards(self, member_id_or_username='me', fields='name',
+                   refresh=False):
+        return self._cached(
+            self._cache_key('boards', member_id_or_username, fields),
+            lambda: self._request(
+                path='/members/%s/boards' % member_id_or_username,
+                endpoint='boards.list',
+                params={
+                    'fields': fields,
+                },
+                keys=_field_keys(fields),
+            ),
+            refresh=refresh,
+        )
+
+    def get_boards_with_lists(self, organization=None, include_closed=False,
+                              refresh=False):
+        """
+        Fetch boards together with their open lists in a single request.
+        """
+        if organization:
+            path = '/organizations/%s/boards' % organization
+        else:
+            path = '/members/me/boards'
+        board_filter = 'all' if include_closed else 'open'
+
+        def fetch():
+            boards = self._request(
+                path=path,
+                endpoint='boards.with_lists',
+                params={
+                    'fields': 'name',
+                    'filter': board_filter,
+                    'lists': 'open',
+                    'list_fields': 'name',
+                },
+                keys=('id', 'name', ('lists', ('id', 'name'))),
+            )
+            return boards
+
+        return self._cached(
+            self._cache_key('boards_with_lists', organization or 'me', board_filter),
+            fetch,
+            refresh=refresh,
+        )
+
+    def get_board_names(self, board_id, refresh=False):
+        """
+        Return the ids of a board's labels, members and open lists keyed by
+        lowercased name (members by username and full name), fetched in one
+        request.
+        """
+        def fetch():
+            board = self._request(
+                path='/boards/%s' % board_id,
+                endpoint='board.names',
+                params={
+                    'fields': 'id',
+                    'labels': 'all',
+                    'label_fields': 'name',
+                    'members': 'all',
+                    'member_fields': 'username,fullName',
+                    'lists': 'open',
+                    'list_fields': 'name',
+                },
+                keys=(
+                    'id',
+                    ('labels', ('id', 'name')),
+                    ('members', ('id', 'username', 'fullName')),
+                    ('lists', ('id', 'name')),
+                ),
+            )
+            index = {
+                'labels': {},
+                'members': {},
+                'lists': {},
+                'fetched_at': time.time(),
+            }
+            for label in board.get('labels', ()):
+                if label.get('name'):
+                    index['labels'][label['name'].lower()] = label['id']
+            for member in board.get('members', ()):
+                for name in (member.get('username'), member.get('fullName')):
+                    if name:
+                        index['members'][name.lower()] = member['id']
+            for board_list in board.get('lists', ()):
+                index['lists'][board_list['name'].lower()] = board_list['id']
+            return index
+
+        return self._cached(
+            self._cache_key('board_names', board_id), fetch, refresh=refresh)
+
+    def resolve_names(self, board_id, labels=(), members=(), lists=()):
+        """
+        Map label, member and list names on a board to ids. The cached index
+        is refetched once on a miss, unless it was fetched within
+        ``names_refresh_interval`` seconds; unknown names are left out.
+        """
+        wanted = {'labels': labels, 'members': members, 'lists': lists}
+        index = self.get_board_names(board_id)
+        missing = any(
+            n.lower() not in index[kind]
+            for kind, names in wanted.items() for n in names
+        )
+        if missing and time.time() - index['fetched_at'] > self.names_refresh_interval:
+            index = self.get_board_names(board_id, refresh=True)
+        return dict(
+            (kind, [index[kind][n.lower()] for n in names if n.lower() in index[kind]])
+            for kind, names in wanted.items()
         )
 
-    def get_organization_list(self, member_id_or_username, fields=None):
+    def invalidate_boards(self, organization=None, board_id=None):
+        """
+        Drop cached boards (and the lists of ``board_id``) so the next read
+        refetches them from Trello.
+        """
+        keys = [
+            self._cache_key('boards_with_lists', organization or 'me', 'open'),
+            self._cache_key('boards_with_lists', organization or 'me', 'all'),
+        ]
+        if organization:
+            keys.append(self._cache_key('organization_boards', organization, 'name'))
+        else:
+            keys.append(self._cache_key('boards', 'me', 'name'))
+        if board_id:
+            keys.append(self._cache_key('board_list', board_id, 'name'))
+            keys.append(self._cache_key('board_names', board_id))
+        for key in keys:
+            self._cache.delete(key)
+        self._search_index(organization).populated = False
+
+    def batch(self, urls):
+        """
+        GET many routes through /batch, ``batch_limit`` routes per request,
+        sending the requests concurrently. Returns the body of each route in
+        order, or None where it failed.
+        """
+        def fetch(chunk):
+            return lambda: self._request(
+                path='/batch',
+                endpoint='batch',
+                params={
+                    # routes are comma separated, so escape commas inside them
+                    'urls': ','.join(u.replace(',', '%2C') for u in chunk),
+                },
+            )
+
+        responses = run_concurrently([
+            fetch(urls[i:i + self.batch_limit])
+            for i in range(0, len(urls), self.batch_limit)
+        ])
+        return [r.get('200') for response in responses for r in response]
+
+    def add_comment(self, card_id, text):
         return self._request(
-            path='/members/%s/organizations' % (member_id_or_username),
-            params={
-                'fields': fields,
-            },
+            path='/cards/%s/actions/comments' % card_id,
+            endpoint='cards.comments',
+            method='POST',
+            data={'text': text},
+            keys=('id',),
         )
 
-    def get_board_list(self, board_id, fields=None):
+    def upload_attachment(self, card_id, name, chunks, mime_type=None,
+                          compress=True):
+        """
+        Stream an attachment to the card as a chunked multipart upload.
+        ``chunks`` is a callable returning an iterable of byte or text
+        chunks (called again if the upload is retried), so large payloads
+        are never held in memory. With ``compress`` the file is gzipped on
+        the fly and ``.gz`` is appended to its name.
+        """
+        if compress:
+            name += '.gz'
+            mime_type = 'application/gzip'
+        boundary = uuid4().hex
+
+        def body():
+            source = chunks()
+            if compress:
+                source = iter_gzip(source)
+            return iter_multipart(boundary, 'file', name, source, mime_type)
+
         return self._request(
-            path='/boards/%s/lists' % (board_id),
-            params={
-                'fields': fields,
+            path='/cards/%s/attachments' % card_id,
+            endpoint='cards.attachments',
+            method='POST',
+            params={'name': name},
+            headers={
+                'Content-Type': 'multipart/form-data; boundary=%s' % boundary,
             },
+            body=body,
+            keys=('id', 'url'),
         )
 
-    def new_card(self, name, idList, desc=None, pos=None):
+    def create_webhook(self, callback_url, id_model, description=None):
         return self._request(
-            path='/cards',
+            path='/webhooks',
+            endpoint='webhooks.create',
             method='POST',
             data={
-                'name': name,
-                'idList': idList,
-                'desc': desc,
-                'pos': pos,
+                'callbackURL': callback_url,
+                'idModel': id_model,
+                'description': description,
             },
+            keys=('id',),
         )
 
-    def get_boards(self, member_id_or_username='me', fields=None):
-        return self._request(
-            path='/members/%s/boards' % member_id_or_username,
-            params={
-                'fields': fields,
-            }
-        )
+    def _search_index(self, organization=None):
+        return search_indexes.get(self._cache_key('search', organization or 'me'))
 
-    def organizations_to_options(self, member_id_or_username='me'):
+    def search_boards(self, query, organization=None, limit=20):
+        """
+        Find open boards and lists by name without calling Trello once the
+        index has been built from the cached boards.
+        """
+        index = self._search_index(organization)
+        boards = self.get_boards_with_lists(organization)
+        # the boards may have been refreshed by another process sharing the
+        # cache (or the warmer), so rebuild whenever the cached copy is newer
+        entry = self._cache.get(
+            self._cache_key('boards_with_lists', organization or 'me', 'open'))
+        fetched_at = entry[1] if entry is not None else time.time()
+        if not index.populated or fetched_at > index.fetched_at:
+            index.update_boards(boards, fetched_at=fetched_at)
+        return index.search(query, limit=limit)
+
+    def get_boards_page(self, organization=None, page=1, per_page=100,
+                        query=None, include_closed=False, refresh=False):
+        """
+        Return one page of boards (with their lists) whose name contains
+        ``query``, and whether more pages follow. Trello has no paging for
+        boards, so pages are cut from the cached board list.
+        """
+        boards = iter(self.get_boards_with_lists(
+            organization, include_closed=include_closed, refresh=refresh))
+        if query:
+            query = query.lower()
+            boards = (b for b in boards if query in b['name'].lower())
+        start = (page - 1) * per_page
+        result = list(islice(boards, start, start + per_page + 1))
+        return result[:per_page], len(result) > per_page
+
+    def organizations_to_options(self, member_id_or_username='me',
+                                 refresh=False):
         organizations = self.get_organization_list(
-            member_id_or_username, fields='name')
-        options = tuple()
-        for org in organizations:
-            options += ((org['id'], org['name']),)
-        return options
+            member_id_or_username, fields='name', refresh=refresh)
+        return tuple((org['id'], org['name']) for org in organizations)
 
-    def boards_to_options(self, organization=None):
+    def boards_to_options(self, organization=None, refresh=False):
         if organization:
-            boards = self.get_organization_boards(organization, fields='name')
+            boards = self.get_organization_boards(
+                organization, fields='name', refresh=refresh)
         else:
-            boards = self.get_boards(fields='name')
-        options = tuple()
-        for board in boards:
-            options += ((board['id'], board['name']),)
-        return options
+            boards = self.get_boards(fields='name', refresh=refresh)
+        return tuple((board['id'], board['name']) for board in boards)
+
+
+class AsyncTrelloClient(object):
+    """
+    Exposes the ``TrelloClient`` methods, but each call is started on the
+    shared thread pool and returns a result whose ``get()`` waits for it.
+    Calls share the pooled sessions, cache and rate limiter of the wrapped
+    client. (The plugin targets Python 2.7, so this uses threads rather
+    than asyncio.)
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.client = kwargs.pop('client', None) or TrelloClient(*args, **kwargs)
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+        if name.startswith('_') or not callable(method):
+            return method
+
+        def call(*args, **kwargs):
+            return submit(lambda: method(*args, **kwargs))
+        return call
+
+    @staticmethod
+    def gather(*results):
+        return [r.get() for r in results]
@@ -0,0 +1,48 @@
+from __future__ import absolute_import
+
+# Trello rejects card descriptions longer than this many characters
+TRELLO_DESCRIPTION_LIMIT = 16384
+
+TRUNCATED_MARKER = '\n\n    [truncated]'
+
+
+def iter_lines(text):
+    """
+    Yield the lines of ``text`` one at a time without building a list of
+    every line up front.
+    """
+    start = 0
+    length = len(text)
+    while start < length:
+        end = text.find('\n', start)
+        if end == -1:
+            end = length
+        yield text[start:end].rstrip('\r')
+        start = end + 1
+
+
+def build_description(url, body, limit=TRELLO_DESCRIPTION_LIMIT):
+    """
+    Return a markdown description with the group URL followed by the body
+    indented as a code block, cut at the last whole line that fits in
+    ``limit`` characters, and whether it was truncated. The URL and the
+    leading (outermost) lines of the body are always kept; a first line too
+    long to fit on its own is cut short rather than dropped.
+    """
+    limit = min(limit, TRELLO_DESCRIPTION_LIMIT)
+    output = [url]
+    if not body:
+        return url, False
+
+    budget = limit - len(url) - len(TRUNCATED_MARKER) - 1
+    output.append('')
+    for line in iter_lines(body):
+        line = '    ' + line
+        if len(line) + 1 > budget:
+            if len(output) == 2 and budget > len('    ') + 1:
+                output.append(line[:budget - 1])
+            output.append(TRUNCATED_MARKER.lstrip('\n'))
+            return '\n'.join(output), True
+        budget -= len(line) + 1
+        output.append(line)
+    return '\n'.join(output), False
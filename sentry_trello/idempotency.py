@@ -0,0 +1,59 @@
+from __future__ import absolute_import
+
+import time
+
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import cache
+from sentry.utils import json
+
+# cache value while the first submission is still creating its card
+IN_PROGRESS = 'in-progress'
+
+# form fields that decide whether two submissions create the same card
+CARD_FIELDS = ('title', 'description', 'trello_board', 'trello_list')
+
+
+def get_window():
+    return getattr(settings, 'SENTRY_TRELLO_CREATE_DEDUPE_WINDOW', 300)
+
+
+def creation_key(group_id, form_data):
+    digest = md5(json.dumps(
+        [form_data.get(f) or '' for f in CARD_FIELDS],
+    ).encode('utf-8')).hexdigest()
+    return 'trello:create:%s:%s' % (group_id, digest)
+
+
+def claim(key):
+    """
+    Mark ``key`` as being created. Returns False if another submission
+    already claimed it within the window.
+    """
+    return cache.add(key, IN_PROGRESS, get_window())
+
+
+def complete(key, issue_id):
+    cache.set(key, issue_id, get_window())
+
+
+def release(key):
+    """
+    Forget a failed creation so the next submission tries again.
+    """
+    cache.delete(key)
+
+
+def wait_for(key, timeout=10, interval=0.2):
+    """
+    Wait for the submission holding ``key`` and return its issue id, or
+    None if it failed. Returns ``IN_PROGRESS`` if it is still running after
+    ``timeout`` seconds.
+    """
+    deadline = time.time() + timeout
+    while True:
+        value = cache.get(key)
+        if value != IN_PROGRESS or time.time() >= deadline:
+            return value
+        time.sleep(interval)
@@ -25,17 +25,33 @@ along with Sentry-Trello. If not, see <http://www.gnu.org/licenses/>.
 """
 from __future__ import absolute_import
 
+import logging
 import sentry_trello
 
+from contextlib import contextmanager
+from json import JSONEncoder
+from uuid import uuid4
+
 from django import forms
+from django.conf import settings
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
 from django.utils.translation import ugettext_lazy as _
 from requests.exceptions import RequestException
 from sentry.plugins.base import JSONResponse
 from sentry.plugins.bases.issue import IssuePlugin, NewIssueForm
 from sentry.exceptions import PluginError
+from sentry.models import Activity, Group, GroupMeta
+from sentry.utils import json, metrics
 from sentry.utils.http import absolute_uri
 
-from .client import TrelloClient
+from . import idempotency
+from .client import TrelloClient, run_concurrently, track_requests
+from .description import TRELLO_DESCRIPTION_LIMIT, build_description
+from .tasks import PENDING_ISSUE, create_card
+from .updates import record_event
+
+logger = logging.getLogger('sentry.plugins.trello')
 
 SETUP_URL = 'https://github.com/getsentry/sentry-trello/blob/master/HOW_TO_SETUP.md'  # NOQA
 
@@ -43,6 +59,14 @@ ISSUES_URL = 'https://github.com/getsentry/sentry-trello/issues'
 
 EMPTY = (('', '--'),)
 
+BOARDS_PER_PAGE = 100
+
+MAX_BULK_GROUPS = 100
+
+EVENT_ENCODER = JSONEncoder(
+    default=lambda o: o.isoformat() if hasattr(o, 'isoformat') else repr(o),
+)
+
 
 class TrelloError(Exception):
     status_code = None
@@ -57,6 +81,15 @@ class TrelloError(Exception):
     def from_response(cls, response):
         return cls(response.text, response.status_code)
 
+    @classmethod
+    def from_exception(cls, exc):
+        resp = exc.response
+        if resp is None:
+            return cls(str(exc) or 'Internal Error')
+        if resp.status_code == 401:
+            return TrelloUnauthorized.from_response(resp)
+        return cls.from_response(resp)
+
 
 class TrelloUnauthorized(TrelloError):
     status_code = 401
@@ -67,7 +100,7 @@ class TrelloForm(NewIssueForm):
         label=_('Title'), max_length=200,
         widget=forms.TextInput(attrs={'class': 'span9'}))
     description = forms.CharField(
-        label=_('Description'),
+        label=_('Description'), max_length=TRELLO_DESCRIPTION_LIMIT,
         widget=forms.Textarea(attrs={'class': 'span9'}))
     trello_board = forms.CharField(label=_('Board'), max_length=50)
     trello_list = forms.CharField(label=_('List'), max_length=50)
@@ -75,7 +108,12 @@ class TrelloForm(NewIssueForm):
     def __init__(self, data=None, initial=None):
         super(TrelloForm, self).__init__(data=data, initial=initial)
         self.fields['trello_board'].widget = forms.Select(
-            choices=EMPTY + initial.get('boards', ())
+            attrs={
+                'data-lists': json.dumps(initial.get('board_lists', {})),
+                'data-more': json.dumps(initial.get('more_boards', False)),
+                'data-default-list': initial.get('default_list') or '',
+            },
+            choices=EMPTY + initial.get('boards', ()),
         )
         self.fields['trello_list'].widget = forms.Select(
             attrs={'disabled': True},
@@ -111,27 +149,32 @@ class TrelloCard(IssuePlugin):
     create_issue_template = 'sentry_trello/create_trello_issue.html'
     plugin_misconfigured_template = 'sentry_trello/plugin_misconfigured.html'
 
-    def __init__(self):
-        super(TrelloCard, self).__init__()
-        self.client_errors = []
-        self.additial_fields = []
-        
     def _get_group_description(self, request, group, event):
         """
-        Return group description in markdown-compatible format.
+        Return group description in markdown-compatible format, truncated to
+        fit Trello's description limit.
 
         This overrides an internal method to IssuePlugin.
         """
-        output = [
+        description, _truncated = build_description(
             absolute_uri(group.get_absolute_url()),
-        ]
-        body = self._get_group_body(request, group, event)
-        if body:
-            output.extend([
-                '',
-                '\n'.join('    ' + line for line in body.splitlines()),
-            ])
-        return '\n'.join(output)
+            self._get_group_body(request, group, event),
+            limit=getattr(settings, 'SENTRY_TRELLO_DESCRIPTION_LIMIT',
+                          TRELLO_DESCRIPTION_LIMIT),
+        )
+        return description
+
+    def post_process(self, group, event, is_new, is_sample, **kwargs):
+        project = group.project
+        if not self.is_configured(None, project):
+            return
+        if not (self.get_option('auto_create', project)
+                and self.get_option('auto_list', project)):
+            return
+        record_event(self, group, event)
+
+    def get_url_module(self):
+        return 'sentry_trello.urls'
 
     def is_configured(self, request, project, **kwargs):
         return all((
@@ -148,13 +191,39 @@ class TrelloCard(IssuePlugin):
             token=self.get_option('token', project),
         )
 
+    def _wants_refresh(self, request):
+        return request.GET.get('refresh') == '1'
+
+    @contextmanager
+    def _track_requests(self, view_name):
+        """
+        Report how many Trello calls (and how long they took) a plugin view
+        made.
+        """
+        with track_requests() as tracker:
+            try:
+                yield tracker
+            finally:
+                tags = {'view': view_name}
+                metrics.timing('trello.view.requests', tracker.count, tags=tags)
+                metrics.timing('trello.view.request_duration', tracker.duration, tags=tags)
+                logger.debug('trello.view.summary', extra={
+                    'view': view_name,
+                    'requests': tracker.count,
+                    'duration': tracker.duration,
+                    'endpoints': [c['endpoint'] for c in tracker.calls],
+                })
+
     def view(self, request, group, **kwargs):
         if request.is_ajax():
             view = self.view_ajax
+            view_name = 'ajax.%s' % request.GET.get('action', '')
         else:
             view = super(TrelloCard, self).view
+            view_name = 'create_issue'
         try:
-            return view(request, group, **kwargs)
+            with self._track_requests(view_name):
+                return view(request, group, **kwargs)
         except TrelloError as e:
             if request.is_ajax():
                 return JSONResponse({})
@@ -164,12 +233,63 @@ class TrelloCard(IssuePlugin):
             })
 
     def view_ajax(self, request, group, **kwargs):
-        if request.GET.get('action', '') != 'lists':
-            return JSONResponse({})
-        board_id = request.GET['board_id']
+        action = request.GET.get('action', '')
         trello = self.get_client(group.project)
-        lists = trello.get_board_list(board_id, fields='name')
-        return JSONResponse({'result': lists})
+        refresh = self._wants_refresh(request)
+        try:
+            if action == 'lists':
+                lists = trello.get_board_list(
+                    request.GET['board_id'], fields='name', refresh=refresh)
+                return JSONResponse({'result': [lst.as_dict() for lst in lists]})
+            if action == 'boards':
+                try:
+                    page = max(int(request.GET.get('page', 1)), 1)
+                except ValueError:
+                    page = 1
+                boards, more = trello.get_boards_page(
+                    organization=self.get_option('organization', group.project),
+                    page=page,
+                    per_page=BOARDS_PER_PAGE,
+                    query=request.GET.get('q'),
+                    include_closed=request.GET.get('closed') == '1',
+                    refresh=refresh,
+                )
+                return JSONResponse({
+                    'result': [self._serialize_board(b) for b in boards],
+                    'more': more,
+                })
+            if action == 'bulk_create' and request.method == 'POST':
+                groups = list(Group.objects.filter(
+                    project=group.project,
+                    id__in=request.POST.getlist('group_id')[:MAX_BULK_GROUPS],
+                ))
+                return JSONResponse({
+                    'result': self.bulk_create_issues(
+                        request, groups,
+                        list_id=request.POST['trello_list'],
+                        board_id=request.POST.get('trello_board'),
+                    ),
+                })
+            if action == 'search_boards':
+                return JSONResponse({
+                    'result': trello.search_boards(
+                        request.GET.get('q', ''),
+                        organization=self.get_option('organization', group.project),
+                    ),
+                })
+        except RequestException as e:
+            raise TrelloError.from_exception(e)
+        return JSONResponse({})
+
+    def _serialize_board(self, board):
+        return {
+            'id': board['id'],
+            'name': board['name'],
+            'lists': [
+                {'id': board_list['id'], 'name': board_list['name']}
+                for board_list in board.get('lists', ())
+            ],
+        }
 
     def get_initial_form_data(self, request, group, event, **kwargs):
         # TODO(dcramer): token is a secret and should be treated like a password
@@ -178,61 +298,299 @@ class TrelloCard(IssuePlugin):
             request, group, event, **kwargs)
         trello = self.get_client(group.project)
         organization = self.get_option('organization', group.project)
-        options = {}
+        options = {
+            'refresh': self._wants_refresh(request),
+            'per_page': BOARDS_PER_PAGE,
+        }
         if organization:
             options['organization'] = organization
         try:
-            boards = trello.boards_to_options(**options)
+            boards, more = trello.get_boards_page(**options)
         except RequestException as e:
-            print(e.request.url)
-            resp = e.response
-            if not resp:
-                raise TrelloError('Internal Error')
-            if resp.status_code == 401:
-                raise TrelloUnauthorized.from_response(resp)
-            raise TrelloError.from_response(resp)
+            raise TrelloError.from_exception(e)
 
+        boards = [self._serialize_board(b) for b in boards]
         initial.update({
-            'boards': boards,
+            'boards': tuple((b['id'], b['name']) for b in boards),
+            'board_lists': dict((b['id'], b['lists']) for b in boards),
+            'more_boards': more,
+            'default_list': self.get_option('list_name', group.project),
         })
         return initial
 
     def get_issue_label(self, group, issue_id, **kwargs):
         iid, iurl = issue_id.split('/', 1)
+        if iid == PENDING_ISSUE:
+            return _('Trello (pending)')
         return _('Trello-%s') % iid
 
     def get_issue_url(self, group, issue_id, **kwargs):
         iid, iurl = issue_id.split('/', 1)
+        if iid == PENDING_ISSUE:
+            return '#'
         return iurl
 
     def get_new_issue_title(self, **kwargs):
         return _('Create Trello Card')
 
-    def create_issue(self, request, group, form_data, **kwargs):
-        trello = self.get_client(group.project)
+    def create_card(self, group, form_data, register_webhook=True):
+        """
+        Create the card on Trello and return its issue id. Callers creating
+        many cards pass ``register_webhook=False`` and register it once.
+        """
+        project = group.project
+        trello = self.get_client(project)
+        label = self.get_option('label', project)
+        labels = [label] if label else []
+        members = []
+        list_id = form_data.get('trello_list')
+        board_id = form_data.get('trello_board')
+
+        names = {
+            'labels': self._option_names('label_name', project),
+            'members': self._option_names('member_name', project),
+            'lists': [] if list_id else self._option_names('list_name', project),
+        }
+        if board_id and any(names.values()):
+            resolved = trello.resolve_names(board_id, **names)
+            labels.extend(resolved['labels'])
+            members.extend(resolved['members'])
+            if resolved['lists']:
+                list_id = resolved['lists'][0]
+
+        card = trello.new_card(
+            name=form_data['title'],
+            desc=form_data['description'],
+            idList=list_id,
+            pos='top',
+            idLabels=labels or None,
+            idMembers=members or None,
+        )
+        if self.get_option('attach_event', group.project):
+            self.attach_event(trello, card['id'], group)
+        if register_webhook:
+            self.ensure_webhook(group.project, form_data.get('trello_board'))
+        return '%s/%s' % (card['id'], card['url'])
+
+    def _option_names(self, key, project):
+        value = self.get_option(key, project) or ''
+        return [n.strip() for n in value.split(',') if n.strip()]
+
+    def attach_event(self, trello, card_id, group):
+        """
+        Attach the complete event as gzipped JSON, streamed so the payload
+        is never fully held in memory.
+        """
+        event = group.get_latest_event()
+        if event is None:
+            return
+
+        def chunks():
+            payload = dict(event.data)
+            payload.update({
+                'event_id': event.event_id,
+                'message': event.message,
+                'datetime': event.datetime,
+            })
+            return EVENT_ENCODER.iterencode(payload)
+
         try:
-            card = trello.new_card(
-                name=form_data['title'],
-                desc=form_data['description'],
-                idList=form_data['trello_list'],
-                pos='top',
+            trello.upload_attachment(
+                card_id,
+                name='event-%s.json' % event.event_id,
+                chunks=chunks,
+                mime_type='application/json',
             )
-            
-            trello._request(
-                path='/cards/' + card['id'] + '/idLabels',
-                method='POST',
-                data={
-                    'value': '5c26950ec6a60131c2fa440d', # Exception label
-                },
+        except RequestException as exc:
+            logger.warning('trello.attachment-failed', extra={
+                'group_id': group.id,
+                'card_id': card_id,
+                'error': str(exc),
+            })
+
+    def has_webhook(self, project, board_id):
+        # boards are stored one option each so concurrent registrations
+        # cannot drop each other
+        return bool(self.get_option('webhook_board:%s' % board_id, project))
+
+    def ensure_webhook(self, project, board_id):
+        """
+        Register a Trello webhook for ``board_id`` so board and list changes
+        invalidate the cache instead of waiting for it to expire. Webhooks
+        are only registered once the API secret is set, so their calls can
+        be verified.
+        """
+        if not board_id or not self.get_option('webhooks', project):
+            return
+        if not self.get_option('webhook_secret', project):
+            logger.warning('trello.webhook.missing-secret', extra={
+                'project_id': project.id,
+            })
+            return
+        if self.has_webhook(project, board_id):
+            return
+        # one registration per board even when cards are created concurrently
+        claim_key = 'trello:webhook:%s:%s' % (project.id, board_id)
+        if not cache.add(claim_key, 1, 60):
+            return
+        callback_url = absolute_uri(reverse(
+            'sentry-plugins-trello-webhook', args=[project.id]))
+        try:
+            self.get_client(project).create_webhook(
+                callback_url, board_id,
+                description='Sentry cache updates for %s' % project.slug,
             )
-            
+        except RequestException as exc:
+            cache.delete(claim_key)
+            logger.warning('trello.webhook.register-failed', extra={
+                'project_id': project.id,
+                'board_id': board_id,
+                'error': str(exc),
+            })
+            return
+        self.set_option('webhook_board:%s' % board_id, True, project)
+
+    def create_issue(self, request, group, form_data, **kwargs):
+        # double submits and retried requests share a key, so only the first
+        # one creates a card and the others get its issue id
+        key = idempotency.creation_key(group.id, form_data)
+        if not idempotency.claim(key):
+            return self._wait_for_issue(request, group, form_data, key)
+        try:
+            issue_id = self._create_issue(group, form_data, key)
+        except Exception:
+            idempotency.release(key)
+            raise
+        if not issue_id.startswith(PENDING_ISSUE + '/'):
+            idempotency.complete(key, issue_id)
+        return issue_id
+
+    def _wait_for_issue(self, request, group, form_data, key):
+        issue_id = idempotency.wait_for(key)
+        if issue_id is None:
+            # the first submission failed, so this one tries again
+            return self.create_issue(request, group, form_data)
+        if issue_id == idempotency.IN_PROGRESS:
+            raise forms.ValidationError(
+                _('This card is still being created, please try again shortly.'))
+        if issue_id.startswith(PENDING_ISSUE + '/'):
+            # an async creation may have finished since; read the table, as
+            # the request's GroupMeta cache predates it
+            linked = GroupMeta.objects.filter(
+                group=group, key='%s:tid' % self.get_conf_key(),
+            ).values_list('value', flat=True).first()
+            return linked or issue_id
+        return issue_id
+
+    def _create_issue(self, group, form_data, key):
+        # eager tasks would run before the view saves the pending link
+        if self.get_option('async_create', group.project) and \
+                not getattr(settings, 'CELERY_ALWAYS_EAGER', False):
+            pending_id = '%s/%s' % (PENDING_ISSUE, uuid4().hex)
+            # recorded before queueing so the task's result is not overwritten
+            idempotency.complete(key, pending_id)
+            create_card.apply_async(kwargs={
+                'group_id': group.id,
+                'form_data': {
+                    'title': form_data['title'],
+                    'description': form_data['description'],
+                    'trello_board': form_data.get('trello_board'),
+                    'trello_list': form_data['trello_list'],
+                },
+                'pending_id': pending_id,
+                'idempotency_key': key,
+            })
+            return pending_id
+
+        try:
+            return self.create_card(group, form_data)
         except RequestException as e:
             raise forms.ValidationError(
                 _('Error adding Trello card: %s') % str(e))
 
-        return '%s/%s' % (card['id'], card['url'])
+    def bulk_create_issues(self, request, groups, list_id, board_id=None):
+        """
+        Create one card per group in ``list_id``, sending the Trello calls
+        from the shared thread pool (the per-token rate limit still applies),
+        and link them all in one batch. Returns a per-group report.
+        """
+        meta_key = '%s:tid' % self.get_conf_key()
+        linked = set(GroupMeta.objects.filter(
+            group__in=groups, key=meta_key,
+        ).values_list('group_id', flat=True))
+
+        report = []
+        pending = []
+        for group in groups:
+            if group.id in linked:
+                report.append({'group_id': group.id, 'status': 'skipped'})
+                continue
+            event = group.get_latest_event()
+            if event is None:
+                report.append({
+                    'group_id': group.id,
+                    'status': 'failed',
+                    'error': 'The issue has no events.',
+                })
+                continue
+            pending.append((group, {
+                'title': self.get_group_title(request, group, event),
+                'description': self._get_group_description(request, group, event),
+                'trello_board': board_id,
+                'trello_list': list_id,
+            }))
+
+        def create(group, form_data):
+            def call():
+                try:
+                    return self.create_card(
+                        group, form_data, register_webhook=False), None
+                except RequestException as exc:
+                    return None, exc
+            return call
+
+        # every card goes to the same board, so register its webhook once
+        if pending:
+            self.ensure_webhook(pending[0][0].project, board_id)
+        results = run_concurrently([create(g, f) for g, f in pending])
+
+        metas = []
+        activities = []
+        for (group, form_data), (issue_id, error) in zip(pending, results):
+            if error is not None:
+                report.append({
+                    'group_id': group.id,
+                    'status': 'failed',
+                    'error': str(error),
+                })
+                continue
+            report.append({
+                'group_id': group.id,
+                'status': 'created',
+                'issue_id': issue_id,
+            })
+            metas.append(GroupMeta(group=group, key=meta_key, value=issue_id))
+            activities.append(Activity(
+                project=group.project,
+                group=group,
+                type=Activity.CREATE_ISSUE,
+                user=request.user,
+                data={
+                    'title': form_data['title'],
+                    'provider': self.get_title(),
+                    'location': self.get_issue_url(group, issue_id),
+                    'label': self.get_issue_label(group=group, issue_id=issue_id),
+                },
+            ))
+        GroupMeta.objects.bulk_create(metas)
+        Activity.objects.bulk_create(activities)
+        return report
 
     def get_config(self, project, **kwargs):
+        with self._track_requests('config'):
+            return self._get_config(project, **kwargs)
+
+    def _get_config(self, project, **kwargs):
         def get_from_initial(initial, field):
             return initial.get(field) or self.get_option(field, project)
 
@@ -259,38 +617,162 @@ class TrelloCard(IssuePlugin):
             token['prefix'] = token_value[:6]
             token['required'] = False
 
-        config = [key, token]
+        label = {
+            'name': 'label',
+            'label': _('Trello Label ID'),
+            'type': 'text',
+            'required': False,
+            'default': get_from_initial(initial, 'label'),
+            'help': _('Label added to every card created from Sentry.'),
+        }
+
+        label_name = {
+            'name': 'label_name',
+            'label': _('Trello Label Names'),
+            'type': 'text',
+            'required': False,
+            'default': get_from_initial(initial, 'label_name'),
+            'help': _('Comma separated label names to add, looked up on the chosen board.'),
+        }
+        member_name = {
+            'name': 'member_name',
+            'label': _('Trello Members'),
+            'type': 'text',
+            'required': False,
+            'default': get_from_initial(initial, 'member_name'),
+            'help': _('Comma separated usernames or full names to assign to new cards.'),
+        }
+        list_name = {
+            'name': 'list_name',
+            'label': _('Default List Name'),
+            'type': 'text',
+            'required': False,
+            'default': get_from_initial(initial, 'list_name'),
+            'help': _('List preselected when a board is chosen.'),
+        }
+        async_create = {
+            'name': 'async_create',
+            'label': _('Create cards in the background'),
+            'type': 'bool',
+            'required': False,
+            'default': get_from_initial(initial, 'async_create'),
+            'help': _('Link a pending card immediately and create it on Trello from a worker.'),
+        }
+
+        webhooks = {
+            'name': 'webhooks',
+            'label': _('Keep boards up to date with webhooks'),
+            'type': 'bool',
+            'required': False,
+            'default': get_from_initial(initial, 'webhooks'),
+            'help': _('Registers a Trello webhook on boards cards are created in. '
+                      'Requires the API secret below. Sentry must be reachable '
+                      'from Trello.'),
+        }
+        webhook_secret = {
+            'name': 'webhook_secret',
+            'label': _('Trello API Secret'),
+            'type': 'secret',
+            'required': False,
+            'help': _('Used to verify webhook signatures.'),
+        }
+        if get_from_initial(initial, 'webhook_secret'):
+            webhook_secret['has_saved_value'] = True
+
+        attach_event = {
+            'name': 'attach_event',
+            'label': _('Attach the full event'),
+            'type': 'bool',
+            'required': False,
+            'default': get_from_initial(initial, 'attach_event'),
+            'help': _('Descriptions are cut to fit Trello; this attaches the complete event as gzipped JSON.'),
+        }
+        auto_create = {
+            'name': 'auto_create',
+            'label': _('Create cards automatically'),
+            'type': 'bool',
+            'required': False,
+            'default': get_from_initial(initial, 'auto_create'),
+            'help': _('Creates a card for each new issue and adds one comment per '
+                      'update window summarizing further events.'),
+        }
+        auto_list = {
+            'name': 'auto_list',
+            'label': _('Automatic Cards List ID'),
+            'type': 'text',
+            'required': False,
+            'default': get_from_initial(initial, 'auto_list'),
+            'help': _('List that automatically created cards are added to.'),
+        }
+        sync_status = {
+            'name': 'sync_status',
+            'label': _('Resolve issues when their card is done'),
+            'type': 'bool',
+            'required': False,
+            'default': get_from_initial(initial, 'sync_status'),
+            'help': _('Resolves issues whose card is archived or moved to a done list.'),
+        }
+        done_lists = {
+            'name': 'done_lists',
+            'label': _('Done Lists'),
+            'type': 'text',
+            'required': False,
+            'default': get_from_initial(initial, 'done_lists') or 'Done',
+            'help': _('Comma separated names of lists that mean a card is done.'),
+        }
+
+        config = [
+            key, token, label, label_name, member_name, list_name,
+            async_create, attach_event, auto_create, auto_list, webhooks,
+            webhook_secret, sync_status, done_lists,
+        ]
 
-        if key_value and token_value:
-            trello = TrelloClient(key_value, token_value)
-            organizations = tuple()
+        if key_value and token_value and (
+                get_from_initial(initial, 'organization')
+                or kwargs.get('add_additial_fields')):
+            # cached per key/token fingerprint, so settings renders only
+            # reach Trello when the credentials change
             try:
-                organizations = trello.organizations_to_options()
+                organizations = TrelloClient(
+                    key_value, token_value).organizations_to_options()
+            except RequestException:
+                # the credentials are checked again in validate_config
+                logger.warning('trello.config.organizations-failed', exc_info=True)
+            else:
                 organization_value = self.get_option('organization', project)
                 if not organization_value:
                     organizations = EMPTY + organizations
-                if get_from_initial(initial, 'organization') or kwargs.get('add_additial_fields'):
-                    config.append({
-                        'name': 'organization',
-                        'label': _('Trello Organization'),
-                        'type': 'select',
-                        'choices': organizations,
-                        'default': organization_value,
-                        'required': True,
-                    })
-            except RequestException as exc:
-                if exc.response is not None and exc.response.status_code == 401:
-                    self.client_errors.append(self.error_messages['invalid_auth'])
-                else:
-                    self.client_errors.append(self.error_messages['api_failure'])
+                config.append({
+                    'name': 'organization',
+                    'label': _('Trello Organization'),
+                    'type': 'select',
+                    'choices': organizations,
+                    'default': organization_value,
+                    'required': True,
+                })
         return config
 
+    def _credentials_error(self, key, token):
+        """
+        Return the message for credentials Trello does not accept, or None.
+        """
+        try:
+            if TrelloClient(key, token).check_credentials(refresh=True):
+                return None
+        except RequestException as exc:
+            if exc.response is None or exc.response.status_code != 401:
+                return self.error_messages['api_failure']
+        return self.error_messages['invalid_auth']
+
     def validate_config(self, project, config, actor):
         super(TrelloCard, self).validate_config(project, config, actor)
-        errors = self.client_errors
-        if errors:
-            self.reset_options(project=project)
-            self.client_errors = []
-            raise PluginError(errors[0])
-            
+        # errors stay local to this call so concurrent saves cannot see
+        # each other's results
+        key = config.get('key') or self.get_option('key', project)
+        token = config.get('token') or self.get_option('token', project)
+        if key and token:
+            error = self._credentials_error(key, token)
+            if error:
+                self.reset_options(project=project)
+                raise PluginError(error)
         return config
@@ -0,0 +1,138 @@
+from __future__ import absolute_import
+
+import six
+import threading
+
+_record_types = {}
+_record_types_lock = threading.Lock()
+
+
+class Record(object):
+    """
+    Compact, read-only view of a Trello object holding only the requested
+    fields. Supports the dict lookups callers used on decoded JSON
+    (``record['name']``, ``record.get('lists', ())``) and compares equal to a
+    dict with the same items.
+    """
+    __slots__ = ()
+    _fields = ()
+
+    def __getitem__(self, key):
+        if key in self._fields:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                pass
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return key in self._fields and hasattr(self, key)
+
+    def keys(self):
+        return [f for f in self._fields if hasattr(self, f)]
+
+    def items(self):
+        return [(f, getattr(self, f)) for f in self.keys()]
+
+    def as_dict(self):
+        """
+        Return the record, and any records nested in it, as plain dicts.
+        """
+        return dict((k, _as_plain(v)) for k, v in self.items())
+
+    def __eq__(self, other):
+        if isinstance(other, (Record, dict)):
+            return self.as_dict() == _as_plain(other)
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        return '<Record %r>' % (self.as_dict(),)
+
+    def __reduce__(self):
+        # record classes are built at runtime, so pickle (e.g. for the
+        # django cache backend) goes through the field names
+        return (_rebuild, (self._fields, self.items()))
+
+
+def _as_plain(value):
+    if isinstance(value, Record):
+        return value.as_dict()
+    if isinstance(value, dict):
+        return dict((k, _as_plain(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return [_as_plain(v) for v in value]
+    return value
+
+
+def record_type(fields):
+    """
+    Return the record class for a tuple of field names, creating it once.
+    """
+    cls = _record_types.get(fields)
+    if cls is not None:
+        return cls
+    with _record_types_lock:
+        cls = _record_types.get(fields)
+        if cls is None:
+            for name in fields:
+                if name.startswith('_') or hasattr(Record, name):
+                    raise ValueError('Invalid record field: %r' % (name,))
+            cls = _record_types[fields] = type('Record', (Record,), {
+                '__slots__': fields,
+                '_fields': fields,
+            })
+    return cls
+
+
+def _rebuild(fields, items):
+    cls = record_type(fields)
+    record = cls.__new__(cls)
+    for key, value in items:
+        setattr(record, key, value)
+    return record
+
+
+def _normalize(fields):
+    return tuple(
+        (f, None) if isinstance(f, six.string_types) else (f[0], _normalize(f[1]))
+        for f in fields
+    )
+
+
+def to_records(value, fields):
+    """
+    Keep only ``fields`` of a decoded Trello object, or of each object in a
+    list. A field is a name, or a ``(name, fields)`` pair to project the
+    object(s) nested under that name.
+    """
+    return _project(value, _normalize(fields))
+
+
+def _project(value, spec):
+    if isinstance(value, list):
+        return [_project(v, spec) for v in value]
+    if not isinstance(value, dict):
+        return value
+    cls = record_type(tuple(name for name, _ in spec))
+    record = cls.__new__(cls)
+    for name, nested in spec:
+        if name in value:
+            item = value[name]
+            if nested is not None:
+                item = _project(item, nested)
+            setattr(record, name, item)
+    return record
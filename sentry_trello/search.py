@@ -0,0 +1,155 @@
+from __future__ import absolute_import
+
+import heapq
+import re
+import threading
+
+from bisect import bisect_left, insort
+from collections import OrderedDict
+
+_token_re = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    return set(t.lower() for t in _token_re.findall(text or ''))
+
+
+class SearchIndex(object):
+    """
+    Prefix index over board and list names. Every word of a name is kept in
+    a sorted list so a query word can be matched with a binary search instead
+    of scanning all boards.
+    """
+
+    def __init__(self):
+        self.populated = False
+        # fetch time of the cached boards the index was last built from
+        self.fetched_at = 0
+        # id -> {'id', 'name', 'type', 'board_id', 'lower', 'tokens'}
+        self._entries = {}
+        # sorted (token, id) pairs
+        self._tokens = []
+        self._lock = threading.Lock()
+
+    def _add(self, entry):
+        entry = dict(entry, lower=entry['name'].lower(),
+                     tokens=tokenize(entry['name']))
+        self._entries[entry['id']] = entry
+        for token in entry['tokens']:
+            insort(self._tokens, (token, entry['id']))
+
+    def _remove(self, entry_id):
+        entry = self._entries.pop(entry_id)
+        for token in entry['tokens']:
+            i = bisect_left(self._tokens, (token, entry_id))
+            if i < len(self._tokens) and self._tokens[i] == (token, entry_id):
+                del self._tokens[i]
+
+    def update_boards(self, boards, fetched_at=None):
+        """
+        Bring the index in line with ``boards`` (as returned by
+        ``TrelloClient.get_boards_with_lists``), touching only the boards and
+        lists that were added, renamed or removed. ``fetched_at`` is when the
+        boards were fetched from Trello.
+        """
+        wanted = {}
+        for board in boards:
+            wanted[board['id']] = {
+                'id': board['id'],
+                'name': board['name'],
+                'type': 'board',
+                'board_id': board['id'],
+            }
+            for board_list in board.get('lists', ()):
+                wanted[board_list['id']] = {
+                    'id': board_list['id'],
+                    'name': board_list['name'],
+                    'type': 'list',
+                    'board_id': board['id'],
+                }
+
+        with self._lock:
+            for entry_id, entry in list(self._entries.items()):
+                new = wanted.get(entry_id)
+                if new is None or new['name'] != entry['name'] or \
+                        new['board_id'] != entry['board_id']:
+                    self._remove(entry_id)
+            for entry_id, entry in wanted.items():
+                if entry_id not in self._entries:
+                    self._add(entry)
+            self.populated = True
+            if fetched_at is not None:
+                self.fetched_at = fetched_at
+
+    def _prefix_range(self, prefix):
+        return (
+            bisect_left(self._tokens, (prefix,)),
+            bisect_left(self._tokens, (prefix + u'\uffff',)),
+        )
+
+    def search(self, query, limit=20):
+        """
+        Return up to ``limit`` entries where every word of ``query`` is a
+        prefix of a word in the name. Boards sort before lists, and names
+        starting with the query sort first.
+        """
+        words = tokenize(query)
+        if not words:
+            return []
+        query = query.strip().lower()
+        with self._lock:
+            # scan only the narrowest word's range and check the remaining
+            # words against each candidate's own tokens
+            ranges = sorted(
+                ((self._prefix_range(w), w) for w in words),
+                key=lambda r: r[0][1] - r[0][0],
+            )
+            (start, end), _word = ranges[0]
+            others = [w for _range, w in ranges[1:]]
+            candidates = set(self._tokens[i][1] for i in range(start, end))
+            entries = []
+            for entry_id in candidates:
+                entry = self._entries[entry_id]
+                if others:
+                    tokens = entry['tokens']
+                    if not all(any(t.startswith(w) for t in tokens) for w in others):
+                        continue
+                entries.append(entry)
+
+        return [
+            dict((k, e[k]) for k in ('id', 'name', 'type', 'board_id'))
+            for e in heapq.nsmallest(limit, entries, key=lambda e: (
+                e['type'] != 'board',
+                not e['lower'].startswith(query),
+                e['lower'],
+            ))
+        ]
+
+
+class SearchIndexRegistry(object):
+    """
+    Keeps one index per token and organization, dropping the least recently
+    used index when more than ``max_size`` are held.
+    """
+
+    def __init__(self, max_size=100):
+        self.max_size = max_size
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            index = self._indexes.pop(key, None)
+            if index is None:
+                index = SearchIndex()
+            self._indexes[key] = index
+            while len(self._indexes) > self.max_size:
+                self._indexes.popitem(last=False)
+            return index
+
+    def clear(self):
+        with self._lock:
+            self._indexes.clear()
+
+
+search_indexes = SearchIndexRegistry()
@@ -0,0 +1,169 @@
+from __future__ import absolute_import
+
+from django.core.cache import cache
+from django.utils import timezone
+from sentry.models import Activity, Group, GroupMeta, GroupStatus
+
+from .client import AsyncTrelloClient
+from .tasks import PENDING_ISSUE
+
+# card -> board mappings rarely change, keep them for a month
+CARD_BOARD_TTL = 60 * 60 * 24 * 30
+
+CARD_ROUTE = '/cards/%s?fields=closed,idBoard&list=true&list_fields=name'
+
+# most actions Trello returns for one board per request
+ACTIONS_LIMIT = 1000
+
+ACTIONS_ROUTE = (
+    '/boards/%s/actions?filter=updateCard:closed,updateCard:idList'
+    '&fields=data&limit=%d&since=%s'
+)
+
+
+def _format_checkpoint(value):
+    # UTC with a trailing Z: a "+00:00" offset would be decoded as a space
+    # once Trello unpacks the batched routes
+    return value.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+
+def _card_board_key(card_id):
+    return 'trello:card-board:%s' % card_id
+
+
+def get_done_lists(plugin, project):
+    names = plugin.get_option('done_lists', project) or 'Done'
+    return set(n.strip().lower() for n in names.split(',') if n.strip())
+
+
+def _is_done(card, done_lists):
+    if card.get('closed'):
+        return True
+    return (card.get('list') or {}).get('name', '').lower() in done_lists
+
+
+def _changed_cards(board_actions, done_lists):
+    """
+    Return ids of cards that were archived or moved to a done list according
+    to each board's actions, looking only at each card's newest change.
+    """
+    done = set()
+    seen = set()
+    for actions in board_actions:
+        # actions come newest first
+        for action in actions or ():
+            data = action.get('data') or {}
+            card = data.get('card') or {}
+            if 'closed' in card:
+                kind = 'closed'
+                finished = bool(card['closed'])
+            elif data.get('listAfter'):
+                kind = 'list'
+                finished = data['listAfter'].get('name', '').lower() in done_lists
+            else:
+                continue
+            if (card.get('id'), kind) in seen:
+                continue
+            seen.add((card.get('id'), kind))
+            if finished:
+                done.add(card.get('id'))
+    return done
+
+
+def sync_card_status(plugin, project):
+    """
+    Resolve unresolved groups whose linked card was archived or moved to a
+    done list. Cards are read through /batch; after the first run only
+    board actions since the last checkpoint are fetched, so each run only
+    looks at cards that changed. The checkpoint only advances once every
+    board's actions were read. Returns the resolved group ids.
+    """
+    meta_key = '%s:tid' % plugin.get_conf_key()
+    cards = {}
+    for group_id, value in GroupMeta.objects.filter(
+        group__project=project,
+        group__status=GroupStatus.UNRESOLVED,
+        key=meta_key,
+    ).values_list('group_id', 'value'):
+        card_id = value.split('/', 1)[0]
+        if card_id != PENDING_ISSUE:
+            cards[card_id] = group_id
+    if not cards:
+        return []
+
+    trello = AsyncTrelloClient(client=plugin.get_client(project))
+    done_lists = get_done_lists(plugin, project)
+    checkpoint = plugin.get_option('sync_checkpoint', project)
+    now = timezone.now()
+
+    if checkpoint:
+        card_boards = cache.get_many([_card_board_key(c) for c in cards])
+    else:
+        card_boards = {}
+    unknown = [c for c in cards if _card_board_key(c) not in card_boards]
+    boards = sorted(set(card_boards.values()))
+
+    # cards we have not seen before are checked in full, for the rest only
+    # the board actions since the last run are read; both run concurrently
+    unknown_cards, board_actions = trello.gather(
+        trello.batch([CARD_ROUTE % c for c in unknown]),
+        trello.batch([
+            ACTIONS_ROUTE % (board_id, ACTIONS_LIMIT, checkpoint)
+            for board_id in boards
+        ]),
+    )
+
+    # boards whose actions could not be read keep the checkpoint where it
+    # is so the next run reads them again; boards with more changes than
+    # one page have their cards checked in full on the next run instead
+    failed = any(actions is None for actions in board_actions)
+    truncated = set(
+        board_id for board_id, actions in zip(boards, board_actions)
+        if actions is not None and len(actions) >= ACTIONS_LIMIT
+    )
+    if truncated:
+        cache.delete_many([
+            key for key, board_id in card_boards.items() if board_id in truncated
+        ])
+
+    finished = set()
+    new_boards = {}
+    for card_id, card in zip(unknown, unknown_cards):
+        if card is None:
+            continue
+        new_boards[_card_board_key(card_id)] = card['idBoard']
+        if _is_done(card, done_lists):
+            finished.add(card_id)
+    if new_boards:
+        cache.set_many(new_boards, CARD_BOARD_TTL)
+
+    finished.update(
+        c for c in _changed_cards(board_actions, done_lists) if c in cards
+    )
+
+    groups = []
+    if finished:
+        groups = list(Group.objects.filter(
+            id__in=[cards[c] for c in finished],
+            status=GroupStatus.UNRESOLVED,
+        ))
+    if groups:
+        Group.objects.filter(
+            id__in=[g.id for g in groups],
+            status=GroupStatus.UNRESOLVED,
+        ).update(
+            status=GroupStatus.RESOLVED,
+            resolved_at=now,
+        )
+        Activity.objects.bulk_create([
+            Activity(
+                project=project,
+                group=group,
+                type=Activity.SET_RESOLVED,
+                data={'provider': plugin.get_title()},
+            )
+            for group in groups
+        ])
+    if not failed:
+        plugin.set_option('sync_checkpoint', _format_checkpoint(now), project)
+    return [g.id for g in groups]
@@ -0,0 +1,221 @@
+from __future__ import absolute_import
+
+import logging
+
+from requests.exceptions import RequestException
+from sentry.tasks.base import instrumented_task
+
+from . import idempotency
+from .client import backoff_delay
+
+logger = logging.getLogger('sentry.plugins.trello')
+
+MAX_CREATE_ATTEMPTS = 5
+
+MAX_LINK_ATTEMPTS = 5
+
+PENDING_ISSUE = 'pending'
+
+
+@instrumented_task(name='sentry_trello.tasks.create_card')
+def create_card(group_id, form_data, pending_id, attempt=0,
+                idempotency_key=None, **kwargs):
+    """
+    Create the Trello card for ``group_id`` and replace the pending issue
+    link with the real card. Failures are re-queued through the broker with
+    backoff so retries survive worker restarts. ``idempotency_key`` is the
+    key ``create_issue`` deduplicated the submission with.
+    """
+    from sentry.models import Group, GroupMeta
+    from sentry.plugins import plugins
+
+    try:
+        group = Group.objects.get(id=group_id)
+    except Group.DoesNotExist:
+        return
+
+    plugin = plugins.get('trello')
+    meta_key = '%s:tid' % plugin.get_conf_key()
+
+    try:
+        issue_id = plugin.create_card(group, form_data)
+    except RequestException as exc:
+        if attempt + 1 >= MAX_CREATE_ATTEMPTS:
+            logger.error('trello.create-card-failed', extra={
+                'group_id': group_id,
+                'error': str(exc),
+            })
+            # only drop the link if it is still ours
+            GroupMeta.objects.filter(
+                group=group, key=meta_key, value=pending_id,
+            ).delete()
+            if idempotency_key:
+                idempotency.release(idempotency_key)
+            return
+        create_card.apply_async(
+            kwargs={
+                'group_id': group_id,
+                'form_data': form_data,
+                'pending_id': pending_id,
+                'attempt': attempt + 1,
+                'idempotency_key': idempotency_key,
+            },
+            countdown=backoff_delay(attempt, base=5, cap=300),
+        )
+        return
+
+    if idempotency_key:
+        idempotency.complete(idempotency_key, issue_id)
+    link_card(group_id=group_id, pending_id=pending_id, issue_id=issue_id)
+    return issue_id
+
+
+@instrumented_task(name='sentry_trello.tasks.link_card')
+def link_card(group_id, pending_id, issue_id, attempt=0, **kwargs):
+    """
+    Replace the pending issue link with ``issue_id``, but only while the link
+    still holds ``pending_id``. The issue view saves the pending link after
+    queueing the card, so a fast worker may get here first; it then tries
+    again later instead of being overwritten by the pending link.
+    """
+    from sentry.models import GroupMeta
+    from sentry.plugins import plugins
+
+    meta_key = '%s:tid' % plugins.get('trello').get_conf_key()
+    if GroupMeta.objects.filter(
+        group=group_id, key=meta_key, value=pending_id,
+    ).update(value=issue_id):
+        return
+
+    if attempt + 1 >= MAX_LINK_ATTEMPTS:
+        logger.error('trello.link-card-failed', extra={
+            'group_id': group_id,
+            'issue_id': issue_id,
+        })
+        return
+    link_card.apply_async(
+        kwargs={
+            'group_id': group_id,
+            'pending_id': pending_id,
+            'issue_id': issue_id,
+            'attempt': attempt + 1,
+        },
+        countdown=backoff_delay(attempt, base=1, cap=60),
+    )
+
+
+@instrumented_task(name='sentry_trello.tasks.sync_card_status')
+def sync_card_status(**kwargs):
+    """
+    Periodically queue a card status sync for every project that enabled it.
+    """
+    from sentry.models import ProjectOption
+
+    for project_id, value in ProjectOption.objects.filter(
+        key='trello:sync_status',
+    ).values_list('project_id', 'value'):
+        if value:
+            sync_project_card_status.delay(project_id=project_id)
+
+
+@instrumented_task(name='sentry_trello.tasks.sync_project_card_status')
+def sync_project_card_status(project_id, **kwargs):
+    from sentry.models import Project
+    from sentry.plugins import plugins
+
+    from .sync import sync_card_status
+
+    try:
+        project = Project.objects.get(id=project_id)
+    except Project.DoesNotExist:
+        return
+
+    try:
+        resolved = sync_card_status(plugins.get('trello'), project)
+    except RequestException as exc:
+        logger.warning('trello.sync-failed', extra={
+            'project_id': project_id,
+            'error': str(exc),
+        })
+        return
+    logger.info('trello.sync', extra={
+        'project_id': project_id,
+        'resolved': len(resolved),
+    })
+
+
+@instrumented_task(name='sentry_trello.tasks.warm_metadata_cache')
+def warm_metadata_cache(**kwargs):
+    """
+    Periodically queue a metadata refresh for every configured project,
+    once per distinct key, token and organization.
+    """
+    from sentry.models import ProjectOption
+
+    options = {}
+    for project_id, key, value in ProjectOption.objects.filter(
+        key__in=('trello:key', 'trello:token', 'trello:organization'),
+    ).values_list('project_id', 'key', 'value'):
+        options.setdefault(project_id, {})[key] = value
+
+    seen = set()
+    for project_id, values in sorted(options.items()):
+        credentials = (
+            values.get('trello:key'),
+            values.get('trello:token'),
+            values.get('trello:organization') or None,
+        )
+        if not all(credentials[:2]) or credentials in seen:
+            continue
+        seen.add(credentials)
+        warm_project_metadata.delay(project_id=project_id)
+
+
+@instrumented_task(name='sentry_trello.tasks.warm_project_metadata')
+def warm_project_metadata(project_id, **kwargs):
+    """
+    Refetch the boards (with their lists) and organizations shown on the
+    create card and settings pages of a project.
+    """
+    from sentry.models import Project
+    from sentry.plugins import plugins
+
+    try:
+        project = Project.objects.get(id=project_id)
+    except Project.DoesNotExist:
+        return
+
+    plugin = plugins.get('trello')
+    trello = plugin.get_client(project)
+    try:
+        trello.get_boards_with_lists(
+            organization=plugin.get_option('organization', project),
+            refresh=True,
+        )
+        trello.organizations_to_options(refresh=True)
+    except RequestException as exc:
+        logger.warning('trello.warm-failed', extra={
+            'project_id': project_id,
+            'error': str(exc),
+        })
+
+
+@instrumented_task(name='sentry_trello.tasks.flush_card_update')
+def flush_card_update(group_id, bucket, attempt=0, **kwargs):
+    from sentry.models import Group
+    from sentry.plugins import plugins
+
+    from .updates import flush_updates
+
+    try:
+        group = Group.objects.get(id=group_id)
+    except Group.DoesNotExist:
+        return
+
+    try:
+        flush_updates(plugins.get('trello'), group, bucket, attempt)
+    except RequestException as exc:
+        logger.warning('trello.update-failed', extra={
+            'group_id': group_id,
+            'error': str(exc),
+        })
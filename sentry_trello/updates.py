@@ -0,0 +1,143 @@
+from __future__ import absolute_import
+
+import time
+
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import cache
+from sentry.models import GroupMeta
+
+from .tasks import PENDING_ISSUE, create_card, flush_card_update
+
+# how long a process holds the claim to create a group's card
+AUTO_CREATE_TIMEOUT = 60 * 60
+
+# windows a flush waits for a pending card before giving up
+MAX_FLUSH_ATTEMPTS = 5
+
+
+def get_window():
+    return getattr(settings, 'SENTRY_TRELLO_UPDATE_WINDOW', 300)
+
+
+def _key(group_id, bucket, name):
+    return 'trello:updates:%s:%s:%s' % (group_id, bucket, name)
+
+
+def _release_key(group_id, bucket, release):
+    return _key(group_id, bucket, 'release:%s' % md5(
+        release.encode('utf-8')).hexdigest())
+
+
+def _incr(key, ttl):
+    """
+    Atomically increment ``key`` and return its new value.
+    """
+    if cache.add(key, 1, ttl):
+        return 1
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, ttl)
+        return 1
+
+
+def get_issue_id(plugin, group):
+    return GroupMeta.objects.filter(
+        group=group,
+        key='%s:tid' % plugin.get_conf_key(),
+    ).values_list('value', flat=True).first()
+
+
+def record_event(plugin, group, event):
+    """
+    Create a card the first time a group is seen and afterwards fold events
+    into the current window. The first event of each window schedules a
+    single flush, so Trello sees at most one write per group per window.
+    """
+    window = get_window()
+    issue_id = get_issue_id(plugin, group)
+    if issue_id is None:
+        # concurrent events of a new group all see no link, only the one
+        # that claims the group creates its card
+        if not cache.add('trello:auto-create:%s' % group.id, 1, AUTO_CREATE_TIMEOUT):
+            return
+        pending_id = '%s/auto' % PENDING_ISSUE
+        GroupMeta.objects.set_value(
+            group, '%s:tid' % plugin.get_conf_key(), pending_id)
+        create_card.delay(
+            group_id=group.id,
+            form_data={
+                'title': plugin.get_group_title(None, group, event),
+                'description': plugin._get_group_description(None, group, event),
+                'trello_list': plugin.get_option('auto_list', group.project),
+            },
+            pending_id=pending_id,
+        )
+        return
+
+    now = time.time()
+    bucket = int(now // window)
+    # kept until the last flush attempt, which may wait for a pending card
+    ttl = window * (MAX_FLUSH_ATTEMPTS + 1)
+    _incr(_key(group.id, bucket, 'count'), ttl)
+
+    # each new release takes the next numbered slot, so concurrent events
+    # with different releases do not overwrite each other
+    release = event.get_tag('sentry:release')
+    if release and cache.add(_release_key(group.id, bucket, release), 1, ttl):
+        index = _incr(_key(group.id, bucket, 'releases'), ttl)
+        cache.set(_key(group.id, bucket, 'release-%d' % index), release, ttl)
+
+    if cache.add(_key(group.id, bucket, 'scheduled'), 1, ttl):
+        flush_card_update.apply_async(
+            kwargs={'group_id': group.id, 'bucket': bucket},
+            countdown=(bucket + 1) * window - now,
+        )
+
+
+def flush_updates(plugin, group, bucket, attempt=0):
+    """
+    Post one comment summarizing the events seen in ``bucket``.
+    """
+    issue_id = get_issue_id(plugin, group)
+    if issue_id is None:
+        return
+    card_id = issue_id.split('/', 1)[0]
+    if card_id == PENDING_ISSUE:
+        # the card is still being created, try again in the next window
+        if attempt + 1 < MAX_FLUSH_ATTEMPTS:
+            flush_card_update.apply_async(
+                kwargs={
+                    'group_id': group.id,
+                    'bucket': bucket,
+                    'attempt': attempt + 1,
+                },
+                countdown=get_window(),
+            )
+        return
+
+    keys = [_key(group.id, bucket, n) for n in ('count', 'releases')]
+    values = cache.get_many(keys)
+    count = values.get(keys[0])
+    if not count:
+        return
+    release_keys = [
+        _key(group.id, bucket, 'release-%d' % i)
+        for i in range(1, (values.get(keys[1]) or 0) + 1)
+    ]
+    releases = [r for r in cache.get_many(release_keys).values() if r]
+
+    lines = [
+        'Seen %d more time%s. Last seen %s.' % (
+            count, '' if count == 1 else 's',
+            group.last_seen.strftime('%Y-%m-%d %H:%M:%S UTC'),
+        ),
+    ]
+    if releases:
+        lines.append('Releases: %s' % ', '.join(sorted(releases)))
+    plugin.get_client(group.project).add_comment(card_id, '\n'.join(lines))
+    cache.delete_many(keys + release_keys + [
+        _release_key(group.id, bucket, r) for r in releases
+    ])
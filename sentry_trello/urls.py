@@ -0,0 +1,11 @@
+from __future__ import absolute_import
+
+from django.conf.urls import patterns, url
+
+from .views import TrelloWebhookView
+
+urlpatterns = patterns(
+    '',
+    url(r'^webhook/(?P<project_id>\d+)/$', TrelloWebhookView.as_view(),
+        name='sentry-plugins-trello-webhook'),
+)
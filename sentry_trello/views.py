@@ -0,0 +1,94 @@
+from __future__ import absolute_import
+
+import base64
+import hmac
+import logging
+
+from hashlib import sha1
+
+from django.http import HttpResponse
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt
+from django.views.generic import View
+from sentry.models import Project
+from sentry.utils import json
+from sentry.utils.http import absolute_uri
+
+logger = logging.getLogger('sentry.plugins.trello')
+
+# board and list changes that make cached boards or lists stale
+INVALIDATING_ACTIONS = frozenset([
+    'createList',
+    'updateList',
+    'moveListFromBoard',
+    'moveListToBoard',
+    'updateBoard',
+])
+
+
+class TrelloWebhookView(View):
+    """
+    Receives Trello webhooks for boards a project uses and drops the cached
+    boards and lists they affect.
+    """
+
+    @method_decorator(csrf_exempt)
+    def dispatch(self, request, *args, **kwargs):
+        return super(TrelloWebhookView, self).dispatch(request, *args, **kwargs)
+
+    def head(self, request, project_id):
+        # Trello checks the callback URL with a HEAD request on registration
+        return HttpResponse(status=200)
+
+    def _is_valid_signature(self, request, secret):
+        expected = base64.b64encode(hmac.new(
+            secret.encode('utf-8'),
+            request.body + absolute_uri(request.path).encode('utf-8'),
+            sha1,
+        ).digest())
+        return hmac.compare_digest(
+            expected, request.META.get('HTTP_X_TRELLO_WEBHOOK', '').encode('utf-8'))
+
+    def post(self, request, project_id):
+        from sentry.plugins import plugins
+
+        try:
+            project = Project.objects.get_from_cache(id=project_id)
+        except Project.DoesNotExist:
+            return HttpResponse(status=404)
+
+        plugin = plugins.get('trello')
+        # unsigned calls are refused, otherwise anyone could keep flushing
+        # the project's cache
+        secret = plugin.get_option('webhook_secret', project)
+        if not secret or not self._is_valid_signature(request, secret):
+            return HttpResponse(status=401)
+
+        try:
+            payload = json.loads(request.body)
+        except ValueError:
+            return HttpResponse(status=400)
+
+        action = payload.get('action') or {}
+        board_id = (payload.get('model') or {}).get('id')
+        if not board_id or not plugin.has_webhook(project, board_id):
+            return HttpResponse(status=410)
+
+        if action.get('type') in INVALIDATING_ACTIONS:
+            data = action.get('data') or {}
+            board_ids = set([board_id])
+            for key in ('board', 'boardSource', 'boardTarget'):
+                changed_id = (data.get(key) or {}).get('id')
+                if changed_id:
+                    board_ids.add(changed_id)
+            trello = plugin.get_client(project)
+            organization = plugin.get_option('organization', project)
+            for changed_board_id in board_ids:
+                trello.invalidate_boards(organization, board_id=changed_board_id)
+            logger.debug('trello.webhook.invalidated', extra={
+                'project_id': project.id,
+                'action': action.get('type'),
+                'boards': list(board_ids),
+            })
+
+        return HttpResponse(status=200)
@@ -0,0 +1,226 @@
+"""
+Load benchmarks for the plugin views against a local fake Trello server.
+
+These are not collected by ``py.test tests``; run them with ``make bench``.
+Each scenario drives a plugin entry point from several threads and prints
+p50/p99 latency, throughput and the number of Trello requests per user
+action. The request budgets asserted below catch regressions in the
+plugin's I/O pattern.
+"""
+from __future__ import absolute_import, print_function
+
+import threading
+import time
+
+from uuid import uuid4
+
+from django.db import connection
+from django.test import RequestFactory
+from sentry.plugins import register, unregister
+from sentry.testutils import TransactionTestCase
+
+from sentry_trello.client import TrelloClient, get_metadata_cache
+from sentry_trello.plugin import TrelloCard
+from sentry_trello.search import search_indexes
+
+from fake_trello import FakeTrello
+
+CONCURRENCY = 8
+
+ACTIONS = 200
+
+
+def unique_title(form_data):
+    # identical submissions are deduplicated, so each action gets its own
+    # title to create a card
+    return dict(form_data, title='Hello world %s' % uuid4().hex)
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100.0))]
+
+
+class BenchmarkResult(object):
+    def __init__(self, name, durations, elapsed, requests, errors):
+        self.name = name
+        self.durations = durations
+        self.elapsed = elapsed
+        self.requests = requests
+        self.errors = errors
+
+    @property
+    def requests_per_action(self):
+        return float(self.requests) / len(self.durations)
+
+    def __str__(self):
+        return '%-28s p50 %7.2fms  p99 %7.2fms  %8.1f/s  %5.2f req/action  %d errors' % (
+            self.name,
+            percentile(self.durations, 50) * 1000,
+            percentile(self.durations, 99) * 1000,
+            len(self.durations) / self.elapsed,
+            self.requests_per_action,
+            self.errors,
+        )
+
+
+class TrelloBenchmark(TransactionTestCase):
+    plugin_cls = TrelloCard
+
+    # shape of the fake Trello account
+    boards = 200
+    lists = 8
+    latency = 0.01
+
+    def setUp(self):
+        super(TrelloBenchmark, self).setUp()
+        register(self.plugin_cls)
+        self.trello = FakeTrello(
+            boards=self.boards, lists=self.lists, latency=self.latency).start()
+        self._base_url = TrelloClient.base_url
+        TrelloClient.base_url = self.trello.url
+        self.plugin = self.plugin_cls()
+        self.group = self.create_group(message='Hello world', culprit='foo.bar')
+        self.event = self.create_event(group=self.group, message='Hello world')
+        self.factory = RequestFactory()
+
+    def tearDown(self):
+        TrelloClient.base_url = self._base_url
+        self.trello.stop()
+        unregister(self.plugin_cls)
+        super(TrelloBenchmark, self).tearDown()
+
+    def configure(self, **options):
+        # a fresh token per scenario starts with empty caches and a full
+        # rate limit bucket
+        get_metadata_cache().clear()
+        search_indexes.clear()
+        options.setdefault('key', 'foo')
+        options.setdefault('token', uuid4().hex)
+        for key, value in options.items():
+            self.plugin.set_option(key, value, self.project)
+
+    def request(self, method='get', path='/', **data):
+        request = getattr(self.factory, method)(path, data)
+        request.user = self.user
+        return request
+
+    def run_scenario(self, name, action, actions=ACTIONS, concurrency=CONCURRENCY):
+        self.trello.reset()
+        durations = []
+        errors = []
+        remaining = iter(range(actions))
+        lock = threading.Lock()
+
+        def worker():
+            try:
+                while True:
+                    with lock:
+                        if next(remaining, None) is None:
+                            return
+                    start = time.time()
+                    try:
+                        action()
+                    except Exception as exc:
+                        errors.append(exc)
+                    durations.append(time.time() - start)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        result = BenchmarkResult(
+            name, durations, time.time() - start,
+            len(self.trello.requests), len(errors))
+        print(result)
+        return result
+
+    def test_initial_form_data(self):
+        self.configure()
+        request = self.request()
+        result = self.run_scenario('get_initial_form_data', lambda: (
+            self.plugin.get_initial_form_data(request, self.group, self.event)
+        ))
+        assert result.errors == 0
+        assert result.requests == 1
+
+    def test_view_ajax(self):
+        self.configure()
+        requests = [
+            self.request(action='boards', q='Board 1'),
+            self.request(action='search_boards', q='list'),
+            self.request(action='lists', board_id='b1'),
+            self.request(action='lists', board_id='b2'),
+        ]
+        counter = iter(range(ACTIONS * 2))
+
+        def action():
+            self.plugin.view_ajax(requests[next(counter) % len(requests)], self.group)
+
+        result = self.run_scenario('view_ajax', action)
+        assert result.errors == 0
+        # the board listing is shared between boards and search_boards
+        assert result.requests <= 3
+
+    def test_create_issue(self):
+        self.configure()
+        request = self.request('post')
+        form_data = {
+            'description': 'foo.bar',
+            'trello_board': 'b1',
+            'trello_list': 'b1l0',
+        }
+        result = self.run_scenario('create_issue', lambda: (
+            self.plugin.create_issue(
+                request, self.group, unique_title(form_data))
+        ), actions=50)
+        assert result.errors == 0
+        assert result.requests_per_action <= 1
+
+    def test_create_issue_with_names(self):
+        self.configure(label_name='Bug', member_name='me', list_name='List 1')
+        request = self.request('post')
+        form_data = {
+            'description': 'foo.bar',
+            'trello_board': 'b1',
+            'trello_list': '',
+        }
+        result = self.run_scenario('create_issue (names)', lambda: (
+            self.plugin.create_issue(
+                request, self.group, unique_title(form_data))
+        ), actions=50)
+        assert result.errors == 0
+        # one card each, plus a single lookup of the board's names
+        assert result.requests <= 51
+
+    def test_get_config(self):
+        self.configure()
+        result = self.run_scenario('get_config', lambda: (
+            self.plugin.get_config(self.project)
+        ))
+        assert result.errors == 0
+        # credentials are only checked when the settings are saved
+        assert result.requests == 0
+
+    def test_get_config_with_organizations(self):
+        self.configure()
+        result = self.run_scenario('get_config (organizations)', lambda: (
+            self.plugin.get_config(self.project, add_additial_fields=True)
+        ))
+        assert result.errors == 0
+        assert result.requests == 1
+
+    def test_initial_form_data_with_faults(self):
+        self.configure()
+        self.trello.throttle_rate = 0.1
+        self.trello.error_rate = 0.02
+        request = self.request(refresh='1')
+        result = self.run_scenario('get_initial_form_data (faults)', lambda: (
+            self.plugin.get_initial_form_data(request, self.group, self.event)
+        ), actions=50)
+        # throttled calls are retried and failures fall back to the cache
+        assert result.errors <= 1
@@ -0,0 +1,217 @@
+"""
+A small stand-in for the Trello API used by the benchmarks. It serves a
+configurable number of boards and lists over real HTTP and can add latency,
+server errors and 429s so the plugin's I/O pattern can be measured.
+"""
+from __future__ import absolute_import
+
+import random
+import re
+import threading
+import time
+
+from six.moves import BaseHTTPServer, socketserver
+from six.moves.urllib.parse import parse_qs, urlparse
+
+from sentry.utils import json
+
+
+class FakeTrello(object):
+    def __init__(self, boards=10, lists=5, organizations=2, latency=0.0,
+                 error_rate=0.0, throttle_rate=0.0, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.organizations = [
+            {'id': 'o%d' % i, 'name': 'Organization %d' % i}
+            for i in range(organizations)
+        ]
+        self.boards = [
+            {
+                'id': 'b%d' % i,
+                'name': 'Board %d' % i,
+                'idOrganization': 'o%d' % (i % max(organizations, 1)),
+                'closed': False,
+                'lists': [
+                    {'id': 'b%dl%d' % (i, j), 'name': 'List %d' % j}
+                    for j in range(lists)
+                ],
+            }
+            for i in range(boards)
+        ]
+        self.requests = []
+        self._cards = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://%s:%d/1/' % self._server.server_address
+
+    def start(self):
+        fake = self
+
+        class Handler(_Handler):
+            trello = fake
+
+        self._server = _Server(('127.0.0.1', 0), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def reset(self):
+        with self._lock:
+            self.requests = []
+
+    def _roll(self, rate):
+        with self._lock:
+            return self._random.random() < rate
+
+    def handle(self, method, path, query):
+        """
+        Return ``(status, body)`` for a request.
+        """
+        with self._lock:
+            self.requests.append((method, path))
+        if self.latency:
+            time.sleep(self.latency)
+        if self._roll(self.throttle_rate):
+            return 429, {'message': 'API_TOKEN_LIMIT_EXCEEDED'}
+        if self._roll(self.error_rate):
+            return 503, {'message': 'unavailable'}
+        return self._route(method, path, query)
+
+    def _route(self, method, path, query):
+        for route_method, pattern, view in self.routes:
+            if route_method != method:
+                continue
+            match = re.match(pattern + '$', path)
+            if match:
+                return view(self, query, *match.groups())
+        return 404, {'message': 'not found'}
+
+    def _boards(self, query, organization=None):
+        boards = self.boards
+        if organization is not None:
+            boards = [b for b in boards if b['idOrganization'] == organization]
+        if query.get('filter') == 'open':
+            boards = [b for b in boards if not b['closed']]
+        with_lists = 'lists' in query
+        return 200, [
+            dict(
+                (k, v) for k, v in b.items()
+                if k != 'lists' or with_lists
+            )
+            for b in boards
+        ]
+
+    def _board(self, query, board_id):
+        for board in self.boards:
+            if board['id'] == board_id:
+                return 200, dict(board, labels=[], members=[])
+        return 404, {'message': 'board not found'}
+
+    def _board_lists(self, query, board_id):
+        status, board = self._board(query, board_id)
+        if status != 200:
+            return status, board
+        return 200, board['lists']
+
+    def _member(self, query):
+        return 200, {'id': 'me', 'username': 'me'}
+
+    def _member_organizations(self, query):
+        return 200, self.organizations
+
+    def _organization_boards(self, query, organization):
+        return self._boards(query, organization)
+
+    def _new_card(self, query):
+        with self._lock:
+            self._cards += 1
+            card_id = 'c%d' % self._cards
+        return 200, {'id': card_id, 'url': 'https://trello.com/c/%s' % card_id}
+
+    def _created(self, query, *args):
+        return 200, {'id': 'x'}
+
+    def _batch(self, query):
+        results = []
+        for route in query.get('urls', '').split(','):
+            route = urlparse(route.replace('%2C', ','))
+            status, body = self._route('GET', route.path, _flatten(parse_qs(route.query)))
+            results.append({str(status): body})
+        return 200, results
+
+    routes = [
+        ('GET', r'/members/me', _member),
+        ('GET', r'/members/me/boards', _boards),
+        ('GET', r'/members/me/organizations', _member_organizations),
+        ('GET', r'/organizations/([^/]+)/boards', _organization_boards),
+        ('GET', r'/boards/([^/]+)', _board),
+        ('GET', r'/boards/([^/]+)/lists', _board_lists),
+        ('GET', r'/batch', _batch),
+        ('POST', r'/cards', _new_card),
+        ('POST', r'/cards/([^/]+)/actions/comments', _created),
+        ('POST', r'/cards/([^/]+)/attachments', _created),
+        ('POST', r'/webhooks', _created),
+    ]
+
+
+def _flatten(query):
+    return dict((k, v[-1]) for k, v in query.items())
+
+
+class _Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # keep-alive, so pooled sessions are exercised like against Trello
+    protocol_version = 'HTTP/1.1'
+    trello = None
+
+    def _read_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                self.rfile.read(size + 2)
+                if not size:
+                    break
+            return
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+
+    def _dispatch(self, method):
+        self._read_body()
+        url = urlparse(self.path)
+        path = url.path
+        if path.startswith('/1/'):
+            path = path[2:]
+        status, body = self.trello.handle(method, path, _flatten(parse_qs(url.query)))
+        content = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        if status == 429:
+            self.send_header('Retry-After', '0')
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def log_message(self, format, *args):
+        pass
@@ -0,0 +1,366 @@
+from __future__ import absolute_import
+
+import responses
+import threading
+import time
+import zlib
+
+from django.db import connection, connections
+from sentry.testutils import TestCase
+
+from sentry_trello.client import (
+    AsyncTrelloClient, CircuitBreaker, CircuitOpenError, LocalCache,
+    RateLimiter, Revalidator, SessionPool, SingleFlight, TokenBucket,
+    TrelloClient, get_circuit_breaker, iter_gzip, run_concurrently,
+    track_requests
+)
+
+
+class SessionPoolTest(TestCase):
+    def test_reuses_session_per_credentials(self):
+        pool = SessionPool(pool_size=2, idle_timeout=60, max_retries=0)
+        assert pool.get('foo', 'bar') is pool.get('foo', 'bar')
+        assert pool.get('foo', 'bar') is not pool.get('foo', 'baz')
+
+    def test_evicts_idle_sessions(self):
+        pool = SessionPool(pool_size=2, idle_timeout=-1, max_retries=0)
+        session = pool.get('foo', 'bar')
+        assert pool.get('foo', 'bar') is not session
+
+    @responses.activate
+    def test_client_uses_pool(self):
+        responses.add(responses.GET, 'https://trello.com/1/members/me/boards',
+                      json=[{'id': '1', 'name': 'Foo'}])
+        pool = SessionPool(pool_size=2, idle_timeout=60, max_retries=0)
+        client = TrelloClient('foo', 'bar', session_pool=pool,
+                              cache=LocalCache(ttl=60, max_size=10))
+        assert client.get_boards(fields='name') == [{'id': '1', 'name': 'Foo'}]
+        assert list(pool._sessions) == [('foo', 'bar')]
+
+
+class LocalCacheTest(TestCase):
+    def test_expires_entries(self):
+        cache = LocalCache(ttl=-1, max_size=10)
+        cache.set('a', [1])
+        assert cache.get('a') is None
+
+    def test_evicts_least_recently_used(self):
+        cache = LocalCache(ttl=60, max_size=2)
+        cache.set('a', [1])
+        cache.set('b', [2])
+        cache.get('a')
+        cache.set('c', [3])
+        assert cache.get('a') == [1]
+        assert cache.get('b') is None
+        assert cache.get('c') == [3]
+
+    @responses.activate
+    def test_client_caches_boards(self):
+        responses.add(responses.GET, 'https://trello.com/1/members/me/boards',
+                      json=[{'id': '1', 'name': 'Foo'}])
+        client = TrelloClient('foo', 'bar', cache=LocalCache(ttl=60, max_size=10))
+        assert client.boards_to_options() == (('1', 'Foo'),)
+        assert client.boards_to_options() == (('1', 'Foo'),)
+        assert len(responses.calls) == 1
+        client.boards_to_options(refresh=True)
+        assert len(responses.calls) == 2
+
+
+class RevalidateTest(TestCase):
+    @responses.activate
+    def test_serves_expired_entry_and_refreshes_in_background(self):
+        responses.add(responses.GET, 'https://trello.com/1/boards/1/lists',
+                      json=[{'id': '15', 'name': 'Todo'}])
+        responses.add(responses.GET, 'https://trello.com/1/boards/1/lists',
+                      json=[{'id': '16', 'name': 'Doing'}])
+        cache = LocalCache(ttl=60, max_size=10)
+        client = TrelloClient('foo', 'bar', cache=cache)
+        assert client.get_board_list('1') == [{'id': '15', 'name': 'Todo'}]
+
+        key = client._cache_key('board_list', '1', 'name')
+        cache.set(key, (cache.get(key)[0], time.time() - 120))
+        assert client.get_board_list('1') == [{'id': '15', 'name': 'Todo'}]
+
+        deadline = time.time() + 5
+        while cache.get(key)[0][0]['id'] == '15' and time.time() < deadline:
+            time.sleep(0.01)
+        assert client.get_board_list('1') == [{'id': '16', 'name': 'Doing'}]
+        assert len(responses.calls) == 2
+
+    @responses.activate
+    def test_drops_entry_rejected_by_trello(self):
+        responses.add(responses.GET, 'https://trello.com/1/members/me', status=401, json={})
+        cache = LocalCache(ttl=60, max_size=10)
+        client = TrelloClient('foo', 'bar', cache=cache)
+        key = client._cache_key('credentials')
+        cache.set(key, (True, time.time() - 120))
+
+        client.revalidate = False
+        assert client.check_credentials() is False
+        assert cache.get(key) is None
+
+    def test_runs_one_refresh_per_key(self):
+        revalidator = Revalidator()
+        release = threading.Event()
+        done = threading.Event()
+
+        def refresh():
+            release.wait()
+            done.set()
+
+        assert revalidator.schedule('key', refresh) is True
+        assert revalidator.schedule('key', refresh) is False
+        release.set()
+        done.wait()
+        # wait for the pending flag to clear after the refresh returns
+        deadline = time.time() + 5
+        while not revalidator.schedule('key', lambda: None) and time.time() < deadline:
+            time.sleep(0.01)
+        assert time.time() < deadline
+
+
+class RateLimiterTest(TestCase):
+    def test_token_bucket_delays_when_empty(self):
+        bucket = TokenBucket(capacity=2, period=10)
+        assert bucket.reserve() == 0
+        assert bucket.reserve() == 0
+        assert 4.9 < bucket.reserve() <= 5
+
+    @responses.activate
+    def test_retries_throttled_requests(self):
+        responses.add(responses.GET, 'https://trello.com/1/members/me/boards',
+                      status=429, json={}, headers={'Retry-After': '0'})
+        responses.add(responses.GET, 'https://trello.com/1/members/me/boards',
+                      json=[{'id': '1', 'name': 'Foo'}])
+        client = TrelloClient('foo', 'bar', cache=LocalCache(ttl=60, max_size=10),
+                              rate_limiter=RateLimiter(capacity=10, period=1))
+        assert client.get_boards() == [{'id': '1', 'name': 'Foo'}]
+        assert len(responses.calls) == 2
+
+
+class SingleFlightTest(TestCase):
+    def test_shares_result_between_concurrent_callers(self):
+        flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            started.set()
+            release.wait()
+            return ['boards']
+
+        results = []
+        leader = threading.Thread(
+            target=lambda: results.append(flight.do('key', fetch)))
+        leader.start()
+        started.wait()
+        follower = threading.Thread(
+            target=lambda: results.append(flight.do('key', fetch)))
+        follower.start()
+        # give the follower time to join the in-flight call
+        time.sleep(0.05)
+        release.set()
+        leader.join()
+        follower.join()
+
+        assert results == [['boards'], ['boards']]
+        assert len(calls) == 1
+
+
+class CircuitBreakerTest(TestCase):
+    def test_opens_after_failures_and_probes(self):
+        breaker = CircuitBreaker(threshold=2, reset_timeout=60)
+        breaker.before_call()
+        breaker.record_failure()
+        breaker.before_call()
+        breaker.record_failure()
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_call()
+
+        breaker.reset_timeout = 0
+        breaker.before_call()
+        # only one probe is allowed while half-open
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_call()
+        breaker.record_success()
+        breaker.before_call()
+
+    @responses.activate
+    def test_records_unexpected_errors(self):
+        responses.add(responses.GET, 'https://trello.com/1/probe',
+                      body=ValueError('boom'))
+        breaker = get_circuit_breaker('probe')
+        breaker.threshold = 1
+        breaker.reset_timeout = 0
+        breaker.record_failure()
+        client = TrelloClient('foo', 'bar', cache=LocalCache(ttl=60, max_size=10))
+        with self.assertRaises(ValueError):
+            client._request('/probe')
+        # the failed probe re-opens the circuit instead of leaving it stuck
+        assert not breaker._probing
+        breaker.before_call()
+
+    @responses.activate
+    def test_serves_stale_cache_on_failure(self):
+        responses.add(responses.GET, 'https://trello.com/1/boards/1/lists',
+                      json=[{'id': '15', 'name': 'Todo'}])
+        responses.add(responses.GET, 'https://trello.com/1/boards/1/lists',
+                      status=503, json={})
+        client = TrelloClient('foo', 'bar', cache=LocalCache(ttl=60, max_size=10))
+        assert client.get_board_list('1') == [{'id': '15', 'name': 'Todo'}]
+        assert client.get_board_list('1', refresh=True) == [{'id': '15', 'name': 'Todo'}]
+        assert len(responses.calls) == 2
+
+
+class InstrumentationTest(TestCase):
+    @responses.activate
+    def test_reports_request_stats(self):
+        responses.add(responses.GET, 'https://trello.com/1/boards/1/lists',
+                      json=[{'id': '15', 'name': 'Todo'}])
+        reported = []
+        client = TrelloClient('foo', 'bar', cache=LocalCache(ttl=60, max_size=10),
+                              on_request=reported.append)
+        with track_requests() as tracker:
+            client.get_board_list('1', fields='name')
+            client.get_board_list('1', fields='name')
+
+        assert tracker.count == 1
+        assert len(reported) == 1
+        assert reported[0]['endpoint'] == 'board.lists'
+        assert reported[0]['status'] == 200
+        assert reported[0]['retries'] == 0
+        assert reported[0]['size'] > 0
+
+
+class BoardsPageTest(TestCase):
+    @responses.activate
+    def test_filters_and_pages_boards(self):
+        responses.add(responses.GET, 'https://trello.com/1/members/me/boards',
+                      json=[{'id': str(i), 'name': 'Board %d' % i} for i in range(25)])
+        client = TrelloClient('foo', 'bar', cache=LocalCache(ttl=60, max_size=10))
+
+        boards, more = client.get_boards_page(page=2, per_page=10)
+        assert [b['id'] for b in boards] == [str(i) for i in range(10, 20)]
+        assert more is True
+
+        boards, more = client.get_boards_page(query='board 2', per_page=10)
+        assert [b['id'] for b in boards] == ['2', '20', '21', '22', '23', '24']
+        assert more is False
+        assert len(responses.calls) == 1
+
+
+class SearchBoardsTest(TestCase):
+    @responses.activate
+    def test_rebuilds_index_from_newer_cached_boards(self):
+        responses.add(responses.GET, 'https://trello.com/1/members/me/boards',
+                      json=[{'id': '1', 'name': 'Foo', 'lists': []}])
+        cache = LocalCache(ttl=60, max_size=10)
+        client = TrelloClient('foo', 'bar', cache=cache)
+        assert [b['id'] for b in client.search_boards('bar')] == []
+
+        # another process refreshed the shared cache
+        key = client._cache_key('boards_with_lists', 'me', 'open')
+        cache.set(key, ([{'id': '2', 'name': 'Bar', 'lists': []}], time.time() + 1))
+        assert [b['id'] for b in client.search_boards('bar')] == ['2']
+        assert len(responses.calls) == 1
+
+
+class AttachmentTest(TestCase):
+    def test_iter_gzip(self):
+        data = b''.join(iter_gzip([u'foo', b'bar'] * 100))
+        assert zlib.decompress(data, 16 + zlib.MAX_WBITS) == b'foobar' * 100
+
+    @responses.activate
+    def test_upload_attachment_streams_multipart(self):
+        responses.add(responses.POST, 'https://trello.com/1/cards/2/attachments',
+                      json={'id': '3'})
+        client = TrelloClient('foo', 'bar', cache=LocalCache(ttl=60, max_size=10))
+        client.upload_attachment(
+            '2', 'event.json', lambda: iter([u'{"a": ', u'1}']),
+            mime_type='application/json', compress=False)
+
+        request = responses.calls[0].request
+        assert 'name=event.json' in request.url
+        assert request.headers['Content-Type'].startswith('multipart/form-data; boundary=')
+        body = b''.join(request.body)
+        assert b'filename="event.json"' in body
+        assert b'\r\n\r\n{"a": 1}\r\n--' in body
+
+
+class NewCardTest(TestCase):
+    @responses.activate
+    def test_keeps_id_and_url(self):
+        responses.add(responses.POST, 'https://trello.com/1/cards', json={
+            'id': '2',
+            'url': 'https://example.trello.com/cards/2',
+            'desc': 'x' * 1000,
+            'badges': {'comments': 0},
+        })
+        client = TrelloClient('foo', 'bar', cache=LocalCache(ttl=60, max_size=10))
+        card = client.new_card(name='Hello', idList='15')
+        assert card == {'id': '2', 'url': 'https://example.trello.com/cards/2'}
+        assert card.get('desc') is None
+
+
+class ResolveNamesTest(TestCase):
+    @responses.activate
+    def test_resolves_names_from_cached_index(self):
+        responses.add(responses.GET, 'https://trello.com/1/boards/1', json={
+            'id': '1',
+            'labels': [{'id': 'l1', 'name': 'Exception'}],
+            'members': [{'id': 'm1', 'username': 'jane', 'fullName': 'Jane Doe'}],
+            'lists': [{'id': '15', 'name': 'Todo'}],
+        })
+        client = TrelloClient('foo', 'bar', cache=LocalCache(ttl=60, max_size=10))
+
+        assert client.resolve_names('1', labels=['exception'], members=['Jane Doe'],
+                                    lists=['todo']) == {
+            'labels': ['l1'], 'members': ['m1'], 'lists': ['15'],
+        }
+        assert client.resolve_names('1', members=['jane']) == {
+            'labels': [], 'members': ['m1'], 'lists': [],
+        }
+        # recently fetched, so a miss does not refetch
+        assert client.resolve_names('1', labels=['missing'])['labels'] == []
+        assert len(responses.calls) == 1
+
+        client.names_refresh_interval = -1
+        client.resolve_names('1', labels=['missing'])
+        assert len(responses.calls) == 2
+
+
+class AsyncTrelloClientTest(TestCase):
+    @responses.activate
+    def test_runs_calls_concurrently(self):
+        responses.add(responses.GET, 'https://trello.com/1/members/me/boards',
+                      json=[{'id': '1', 'name': 'Foo'}])
+        responses.add(responses.GET, 'https://trello.com/1/boards/1/lists',
+                      json=[{'id': '15', 'name': 'Todo'}])
+        trello = AsyncTrelloClient('foo', 'bar', cache=LocalCache(ttl=60, max_size=10))
+
+        boards, lists = trello.gather(
+            trello.get_boards(fields='name'),
+            trello.get_board_list('1', fields='name'),
+        )
+        assert boards == [{'id': '1', 'name': 'Foo'}]
+        assert lists == [{'id': '15', 'name': 'Todo'}]
+
+    def test_run_concurrently_raises_errors(self):
+        def fail():
+            raise ValueError('nope')
+
+        with self.assertRaises(ValueError):
+            run_concurrently([lambda: 1, fail])
+        assert run_concurrently([lambda: 1, lambda: 2]) == [1, 2]
+
+    def test_run_concurrently_closes_worker_connections(self):
+        def query():
+            connection.cursor()
+            # the connection object is local to the pool thread
+            return connections['default']
+
+        worker_connection = run_concurrently([query])[0]
+        assert worker_connection is not connections['default']
+        assert worker_connection.connection is None
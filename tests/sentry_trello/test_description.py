@@ -0,0 +1,39 @@
+from __future__ import absolute_import
+
+from sentry.testutils import TestCase
+
+from sentry_trello.description import (
+    TRELLO_DESCRIPTION_LIMIT, build_description, iter_lines
+)
+
+
+class BuildDescriptionTest(TestCase):
+    def test_iter_lines(self):
+        assert list(iter_lines('a\r\nb\n\nc')) == ['a', 'b', '', 'c']
+
+    def test_keeps_short_body(self):
+        description, truncated = build_description('http://example.com', 'foo\nbar')
+        assert description == 'http://example.com\n\n    foo\n    bar'
+        assert truncated is False
+
+    def test_truncates_at_limit(self):
+        body = '\n'.join('frame %d' % i for i in range(1000))
+        description, truncated = build_description('http://example.com', body, limit=200)
+        assert truncated is True
+        assert len(description) <= 200
+        assert description.startswith('http://example.com\n\n    frame 0\n')
+        assert description.endswith('    [truncated]')
+
+    def test_never_exceeds_trello_limit(self):
+        body = 'x' * 100 + '\n' + 'y' * (TRELLO_DESCRIPTION_LIMIT * 2)
+        description, truncated = build_description('http://example.com', body, limit=10 ** 6)
+        assert truncated is True
+        assert len(description) <= TRELLO_DESCRIPTION_LIMIT
+
+    def test_cuts_long_first_line(self):
+        body = 'x' * 20000 + '\n' + 'frame 0'
+        description, truncated = build_description('http://example.com', body)
+        assert truncated is True
+        assert len(description) <= TRELLO_DESCRIPTION_LIMIT
+        assert description.startswith('http://example.com\n\n    xxx')
+        assert description.endswith('x\n    [truncated]')
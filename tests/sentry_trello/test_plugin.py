@@ -2,14 +2,24 @@ from __future__ import absolute_import
 
 import responses
 
+from django import forms
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
+from django.test import RequestFactory
 from exam import fixture
+from mock import patch
+from sentry.exceptions import PluginError
 from sentry.models import GroupMeta
 from sentry.plugins import register, unregister
 from sentry.testutils import TestCase
 from sentry.utils import json
 
+from sentry_trello import idempotency
+from sentry_trello.client import get_metadata_cache
+from sentry_trello.description import TRELLO_DESCRIPTION_LIMIT
 from sentry_trello.plugin import TrelloCard
+from sentry_trello.search import search_indexes
+from sentry_trello.tasks import create_card
 
 
 def show_response_error(response):
@@ -24,11 +34,13 @@ def trello_mock():
 
     mock = responses.RequestsMock(assert_all_requests_are_fired=False)
     mock.add(mock.GET, 'https://trello.com/1/members/me/boards',
-             json=[{'id': '1', 'name': 'Foo'}])
+             json=[{'id': '1', 'name': 'Foo', 'lists': [{'id': '15', 'name': 'Todo'}]}])
     mock.add(mock.POST, 'https://trello.com/1/cards',
              json={'id': '2', 'url': 'https://example.trello.com/cards/2'})
     mock.add(mock.GET, 'https://trello.com/1/members/me/organizations',
              json=[{'id': '3', 'name': 'Bar'}])
+    mock.add(mock.GET, 'https://trello.com/1/members/me',
+             json={'id': '4'})
 
     return mock
 
@@ -39,6 +51,9 @@ class TrelloPluginTest(TestCase):
     def setUp(self):
         super(TrelloPluginTest, self).setUp()
         register(self.plugin_cls)
+        get_metadata_cache().clear()
+        search_indexes.clear()
+        cache.clear()
         self.group = self.create_group(message='Hello world', culprit='foo.bar')
         self.event = self.create_event(group=self.group, message='Hello world')
 
@@ -106,8 +121,114 @@ class TrelloPluginTest(TestCase):
                 'desc': 'A ticket description',
                 'idList': '15',
                 'name': 'foo',
+                'pos': 'top',
             }
 
+    def test_create_issue_rejects_long_description(self):
+        project = self.project
+        plugin = self.plugin
+
+        plugin.set_option('key', 'foo', project)
+        plugin.set_option('token', 'bar', project)
+
+        self.login_as(self.user)
+
+        with trello_mock() as mock:
+            response = self.client.post(self.action_path, {
+                'title': 'foo',
+                'description': 'x' * (TRELLO_DESCRIPTION_LIMIT + 1),
+                'trello_board': '1',
+                'trello_list': '15',
+            })
+
+            assert response.status_code == 200
+            assert 'description' in response.context['form'].errors
+            assert not [c for c in mock.calls if c.request.method == 'POST']
+        assert not GroupMeta.objects.filter(group=self.group).exists()
+
+    def test_create_issue_deduplicates_submits(self):
+        project = self.project
+        plugin = self.plugin
+
+        plugin.set_option('key', 'foo', project)
+        plugin.set_option('token', 'bar', project)
+
+        form_data = {
+            'title': 'foo',
+            'description': 'A ticket description',
+            'trello_board': '1',
+            'trello_list': '15',
+        }
+        with trello_mock() as mock:
+            first = plugin.create_issue(None, self.group, form_data)
+            second = plugin.create_issue(None, self.group, dict(form_data))
+            assert first == second == '2/https://example.trello.com/cards/2'
+            assert len([c for c in mock.calls if c.request.method == 'POST']) == 1
+
+            plugin.create_issue(None, self.group, dict(form_data, title='bar'))
+            assert len([c for c in mock.calls if c.request.method == 'POST']) == 2
+
+    def test_duplicate_submit_sees_finished_async_creation(self):
+        form_data = {
+            'title': 'foo',
+            'description': 'A ticket description',
+            'trello_list': '15',
+        }
+        key = idempotency.creation_key(self.group.id, form_data)
+        idempotency.claim(key)
+        idempotency.complete(key, 'pending/abc')
+        assert self.plugin.create_issue(None, self.group, form_data) == 'pending/abc'
+
+        GroupMeta.objects.create(
+            group=self.group, key='trello:tid',
+            value='2/https://example.trello.com/cards/2')
+        assert self.plugin.create_issue(None, self.group, form_data) == \
+            '2/https://example.trello.com/cards/2'
+
+    def test_create_issue_retries_after_failure(self):
+        project = self.project
+        plugin = self.plugin
+
+        plugin.set_option('key', 'foo', project)
+        plugin.set_option('token', 'bar', project)
+
+        form_data = {
+            'title': 'foo',
+            'description': 'A ticket description',
+            'trello_list': '15',
+        }
+        with responses.RequestsMock() as mock:
+            mock.add(mock.POST, 'https://trello.com/1/cards', status=400, json={})
+            with self.assertRaises(forms.ValidationError):
+                plugin.create_issue(None, self.group, form_data)
+
+        with trello_mock() as mock:
+            assert plugin.create_issue(None, self.group, form_data) == \
+                '2/https://example.trello.com/cards/2'
+
+    def test_create_issue_saves_with_label(self):
+        project = self.project
+        plugin = self.plugin
+
+        plugin.set_option('key', 'foo', project)
+        plugin.set_option('token', 'bar', project)
+        plugin.set_option('label', '5c26950ec6a60131c2fa440d', project)
+
+        self.login_as(self.user)
+
+        with trello_mock() as mock:
+            response = self.client.post(self.action_path, {
+                'title': 'foo',
+                'description': 'A ticket description',
+                'trello_board': '1',
+                'trello_list': '15',
+            })
+
+            assert response.status_code == 302, show_response_error(response)
+            assert len(mock.calls) == 1
+            body = json.loads(mock.calls[0].request.body)
+            assert body['idLabels'] == '5c26950ec6a60131c2fa440d'
+
     @responses.activate
     def test_create_issue_with_fetch_errors(self):
         project = self.project
@@ -168,3 +289,307 @@ class TrelloPluginTest(TestCase):
         assert 'name="trello-token"' in response.content
         assert 'name="trello-key"' in response.content
         assert 'name="trello-organization"' in response.content
+
+    def test_create_issue_caches_boards(self):
+        project = self.project
+        plugin = self.plugin
+
+        plugin.set_option('key', 'foo', project)
+        plugin.set_option('token', 'bar', project)
+
+        self.login_as(self.user)
+
+        with trello_mock() as mock:
+            self.client.get(self.action_path)
+            self.client.get(self.action_path)
+            assert len(mock.calls) == 1
+
+            self.client.get(self.action_path + '?refresh=1')
+            assert len(mock.calls) == 2
+
+    def test_create_issue_async_when_eager(self):
+        project = self.project
+        plugin = self.plugin
+
+        plugin.set_option('key', 'foo', project)
+        plugin.set_option('token', 'bar', project)
+        plugin.set_option('async_create', True, project)
+
+        self.login_as(self.user)
+
+        with trello_mock(), self.tasks():
+            response = self.client.post(self.action_path, {
+                'title': 'foo',
+                'description': 'A ticket description',
+                'trello_board': '1',
+                'trello_list': '15',
+            })
+
+        assert response.status_code == 302, show_response_error(response)
+        meta = GroupMeta.objects.get(group=self.group, key='trello:tid')
+        assert meta.value == '2/https://example.trello.com/cards/2'
+
+    @patch('sentry_trello.plugin.create_card.apply_async')
+    def test_create_issue_async(self, apply_async):
+        project = self.project
+        plugin = self.plugin
+
+        plugin.set_option('key', 'foo', project)
+        plugin.set_option('token', 'bar', project)
+        plugin.set_option('async_create', True, project)
+
+        self.login_as(self.user)
+
+        with trello_mock(), self.settings(CELERY_ALWAYS_EAGER=False):
+            response = self.client.post(self.action_path, {
+                'title': 'foo',
+                'description': 'A ticket description',
+                'trello_board': '1',
+                'trello_list': '15',
+            })
+
+        assert response.status_code == 302, show_response_error(response)
+        meta = GroupMeta.objects.get(group=self.group, key='trello:tid')
+        assert meta.value.startswith('pending/')
+        assert plugin.get_issue_label(self.group, meta.value) == 'Trello (pending)'
+        assert apply_async.call_count == 1
+        kwargs = apply_async.call_args[1]['kwargs']
+        assert kwargs['pending_id'] == meta.value
+
+        with trello_mock(), self.tasks():
+            create_card(**kwargs)
+        meta = GroupMeta.objects.get(group=self.group, key='trello:tid')
+        assert meta.value == '2/https://example.trello.com/cards/2'
+
+    def test_create_card_task_only_replaces_pending_link(self):
+        project = self.project
+        plugin = self.plugin
+
+        plugin.set_option('key', 'foo', project)
+        plugin.set_option('token', 'bar', project)
+        form_data = {
+            'title': 'foo',
+            'description': 'A ticket description',
+            'trello_list': '15',
+        }
+
+        GroupMeta.objects.create(group=self.group, key='trello:tid', value='pending/abc')
+        with trello_mock(), self.tasks():
+            create_card(group_id=self.group.id, form_data=form_data,
+                        pending_id='pending/abc')
+        meta = GroupMeta.objects.get(group=self.group, key='trello:tid')
+        assert meta.value == '2/https://example.trello.com/cards/2'
+
+        # a link that is not the pending one is left alone
+        with trello_mock(), self.tasks():
+            create_card(group_id=self.group.id, form_data=form_data,
+                        pending_id='pending/def')
+        meta = GroupMeta.objects.get(group=self.group, key='trello:tid')
+        assert meta.value == '2/https://example.trello.com/cards/2'
+
+    def test_ensure_webhook_requires_secret(self):
+        project = self.project
+        plugin = self.plugin
+
+        plugin.set_option('key', 'foo', project)
+        plugin.set_option('token', 'bar', project)
+        plugin.set_option('webhooks', True, project)
+
+        with responses.RequestsMock() as mock:
+            mock.add(mock.POST, 'https://trello.com/1/webhooks', json={'id': '5'})
+            plugin.ensure_webhook(project, '1')
+            assert len(mock.calls) == 0
+
+            plugin.set_option('webhook_secret', 'secret', project)
+            plugin.ensure_webhook(project, '1')
+            plugin.ensure_webhook(project, '1')
+            assert len(mock.calls) == 1
+        assert plugin.has_webhook(project, '1')
+
+    def test_pending_issue_label(self):
+        plugin = self.plugin
+        assert plugin.get_issue_label(self.group, 'pending/abc') == 'Trello (pending)'
+        assert plugin.get_issue_url(self.group, 'pending/abc') == '#'
+
+    def test_create_issue_embeds_board_lists(self):
+        project = self.project
+        plugin = self.plugin
+
+        plugin.set_option('key', 'foo', project)
+        plugin.set_option('token', 'bar', project)
+
+        self.login_as(self.user)
+
+        with trello_mock() as mock:
+            response = self.client.get(self.action_path)
+            assert len(mock.calls) == 1
+            assert 'lists=open' in mock.calls[0].request.url
+
+        assert response.status_code == 200, vars(response)
+        form = response.context['form']
+        lists = json.loads(form.fields['trello_board'].widget.attrs['data-lists'])
+        assert lists == {'1': [{'id': '15', 'name': 'Todo'}]}
+
+    def test_view_ajax_pages_boards(self):
+        project = self.project
+        plugin = self.plugin
+
+        plugin.set_option('key', 'foo', project)
+        plugin.set_option('token', 'bar', project)
+
+        self.login_as(self.user)
+
+        boards = [{'id': str(i), 'name': 'Board %d' % i, 'lists': []} for i in range(150)]
+        with responses.RequestsMock() as mock:
+            mock.add(mock.GET, 'https://trello.com/1/members/me/boards', json=boards)
+            response = self.client.get(
+                self.action_path + '?action=boards&page=2',
+                HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+            )
+            assert 'filter=open' in mock.calls[0].request.url
+
+        data = json.loads(response.content)
+        assert [b['id'] for b in data['result']] == [str(i) for i in range(100, 150)]
+        assert data['more'] is False
+
+    def test_view_ajax_search_boards(self):
+        project = self.project
+        plugin = self.plugin
+
+        plugin.set_option('key', 'foo', project)
+        plugin.set_option('token', 'bar', project)
+
+        self.login_as(self.user)
+
+        with trello_mock() as mock:
+            for q in ('f', 'fo', 'foo'):
+                response = self.client.get(
+                    self.action_path + '?action=search_boards&q=' + q,
+                    HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+                )
+                data = json.loads(response.content)
+                assert [r['id'] for r in data['result']] == ['1']
+            assert len(mock.calls) == 1
+
+    def test_bulk_create_issues(self):
+        project = self.project
+        plugin = self.plugin
+
+        plugin.set_option('key', 'foo', project)
+        plugin.set_option('token', 'bar', project)
+
+        other_group = self.create_group(message='Goodbye world', culprit='foo.baz')
+        self.create_event(group=other_group, message='Goodbye world')
+        GroupMeta.objects.create(group=other_group, key='trello:tid', value='1/url')
+
+        self.login_as(self.user)
+
+        with trello_mock() as mock:
+            response = self.client.post(
+                self.action_path + '?action=bulk_create', {
+                    'group_id': [self.group.id, other_group.id],
+                    'trello_list': '15',
+                },
+                HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+            )
+            assert len(mock.calls) == 1
+
+        report = json.loads(response.content)['result']
+        assert sorted(report, key=lambda r: r['status']) == [
+            {'group_id': self.group.id, 'status': 'created',
+             'issue_id': '2/https://example.trello.com/cards/2'},
+            {'group_id': other_group.id, 'status': 'skipped'},
+        ]
+        meta = GroupMeta.objects.get(group=self.group, key='trello:tid')
+        assert meta.value == '2/https://example.trello.com/cards/2'
+
+    def test_bulk_create_issues_reports_groups_without_events(self):
+        project = self.project
+        plugin = self.plugin
+
+        plugin.set_option('key', 'foo', project)
+        plugin.set_option('token', 'bar', project)
+        plugin.set_option('webhooks', True, project)
+        plugin.set_option('webhook_secret', 'secret', project)
+
+        empty_group = self.create_group(message='Empty', culprit='foo.qux')
+        other_group = self.create_group(message='Goodbye world', culprit='foo.baz')
+        self.create_event(group=other_group, message='Goodbye world')
+
+        request = RequestFactory().post('/')
+        request.user = self.user
+        with trello_mock() as mock:
+            mock.add(mock.POST, 'https://trello.com/1/webhooks', json={'id': '5'})
+            report = plugin.bulk_create_issues(
+                request,
+                [self.group, empty_group, other_group], list_id='15', board_id='1')
+            webhook_calls = [c for c in mock.calls if c.request.url.startswith(
+                'https://trello.com/1/webhooks')]
+            assert len(webhook_calls) == 1
+
+        statuses = dict((r['group_id'], r['status']) for r in report)
+        assert statuses == {
+            self.group.id: 'created',
+            empty_group.id: 'failed',
+            other_group.id: 'created',
+        }
+
+    def test_create_issue_resolves_names(self):
+        project = self.project
+        plugin = self.plugin
+
+        plugin.set_option('key', 'foo', project)
+        plugin.set_option('token', 'bar', project)
+        plugin.set_option('label_name', 'Exception', project)
+        plugin.set_option('member_name', 'jane', project)
+
+        self.login_as(self.user)
+
+        with trello_mock() as mock:
+            mock.add(mock.GET, 'https://trello.com/1/boards/1', json={
+                'id': '1',
+                'labels': [{'id': 'l1', 'name': 'Exception'}],
+                'members': [{'id': 'm1', 'username': 'jane', 'fullName': 'Jane Doe'}],
+                'lists': [],
+            })
+            response = self.client.post(self.action_path, {
+                'title': 'foo',
+                'description': 'A ticket description',
+                'trello_board': '1',
+                'trello_list': '15',
+            })
+
+            assert response.status_code == 302, show_response_error(response)
+            body = json.loads(mock.calls[-1].request.body)
+            assert body['idLabels'] == 'l1'
+            assert body['idMembers'] == 'm1'
+
+    def test_validate_config_rejects_revoked_credentials(self):
+        project = self.project
+        plugin = self.plugin
+        config = {'key': 'foo', 'token': 'bar'}
+
+        with responses.RequestsMock() as mock:
+            mock.add(mock.GET, 'https://trello.com/1/members/me', json={'id': '1'})
+            # rendering the settings does not call Trello
+            plugin.get_config(project)
+            assert len(mock.calls) == 0
+            assert plugin.validate_config(project, config, self.user) == config
+
+            mock.reset()
+            mock.add(mock.GET, 'https://trello.com/1/members/me', status=401, json={})
+            with self.assertRaises(PluginError):
+                plugin.validate_config(project, config, self.user)
+
+    def test_validate_config_rejects_invalid_credentials(self):
+        project = self.project
+        plugin = self.plugin
+
+        with responses.RequestsMock() as mock:
+            mock.add(mock.GET, 'https://trello.com/1/members/me', status=401, json={})
+            with self.assertRaises(PluginError):
+                plugin.validate_config(project, {'key': 'foo', 'token': 'baz'}, self.user)
+            # valid credentials are not affected by the earlier failure
+            mock.reset()
+            mock.add(mock.GET, 'https://trello.com/1/members/me', json={'id': '1'})
+            plugin.validate_config(project, {'key': 'foo', 'token': 'bar'}, self.user)
@@ -0,0 +1,37 @@
+from __future__ import absolute_import
+
+import pickle
+
+from sentry.testutils import TestCase
+
+from sentry_trello.records import Record, to_records
+
+
+class ToRecordsTest(TestCase):
+    def test_keeps_only_requested_fields(self):
+        boards = to_records([{
+            'id': '1',
+            'name': 'Foo',
+            'prefs': {'background': 'blue'},
+            'lists': [{'id': '15', 'name': 'Todo', 'pos': 1}],
+        }], ('id', 'name', ('lists', ('id', 'name'))))
+
+        board = boards[0]
+        assert isinstance(board, Record)
+        assert board['name'] == 'Foo'
+        assert board['lists'][0]['name'] == 'Todo'
+        assert board.get('prefs') is None
+        assert 'prefs' not in board
+        assert board == {'id': '1', 'name': 'Foo', 'lists': [{'id': '15', 'name': 'Todo'}]}
+        assert board.as_dict()['lists'] == [{'id': '15', 'name': 'Todo'}]
+
+    def test_missing_fields(self):
+        board = to_records({'id': '1'}, ('id', 'lists'))
+        assert board.get('lists', ()) == ()
+        assert board.keys() == ['id']
+        with self.assertRaises(KeyError):
+            board['lists']
+
+    def test_pickles(self):
+        board = to_records({'id': '1', 'name': 'Foo'}, ('id', 'name'))
+        assert pickle.loads(pickle.dumps(board, 2)) == board
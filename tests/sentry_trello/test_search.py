@@ -0,0 +1,36 @@
+from __future__ import absolute_import
+
+from sentry.testutils import TestCase
+
+from sentry_trello.search import SearchIndex
+
+
+class SearchIndexTest(TestCase):
+    def setUp(self):
+        super(SearchIndexTest, self).setUp()
+        self.index = SearchIndex()
+        self.index.update_boards([
+            {'id': '1', 'name': 'Backend Bugs', 'lists': [
+                {'id': '11', 'name': 'Todo'},
+                {'id': '12', 'name': 'Done'},
+            ]},
+            {'id': '2', 'name': 'Frontend', 'lists': [
+                {'id': '21', 'name': 'Backlog'},
+            ]},
+        ])
+
+    def test_matches_word_prefixes(self):
+        assert [e['id'] for e in self.index.search('ba')] == ['1', '21']
+        assert [e['id'] for e in self.index.search('bug back')] == ['1']
+        assert self.index.search('nope') == []
+
+    def test_updates_incrementally(self):
+        self.index.update_boards([
+            {'id': '1', 'name': 'Platform Bugs', 'lists': [
+                {'id': '11', 'name': 'Todo'},
+            ]},
+        ])
+        assert self.index.search('backend') == []
+        assert self.index.search('done') == []
+        assert [e['id'] for e in self.index.search('plat')] == ['1']
+        assert [e['id'] for e in self.index.search('todo')] == ['11']
@@ -0,0 +1,119 @@
+from __future__ import absolute_import
+
+import responses
+
+from django.core.cache import cache
+from exam import fixture
+from sentry.models import Activity, GroupMeta, GroupStatus
+from sentry.plugins import register, unregister
+from sentry.testutils import TestCase
+from six.moves.urllib.parse import parse_qs, urlparse
+
+from sentry_trello.client import get_metadata_cache
+from sentry_trello.plugin import TrelloCard
+from sentry_trello.sync import ACTIONS_LIMIT, sync_card_status
+
+
+class SyncCardStatusTest(TestCase):
+    plugin_cls = TrelloCard
+
+    def setUp(self):
+        super(SyncCardStatusTest, self).setUp()
+        register(self.plugin_cls)
+        get_metadata_cache().clear()
+        cache.clear()
+        self.plugin.set_option('key', 'foo', self.project)
+        self.plugin.set_option('token', 'bar', self.project)
+        self.done = self.create_group(message='Done', culprit='a')
+        self.open = self.create_group(message='Open', culprit='b')
+        GroupMeta.objects.create(group=self.done, key='trello:tid', value='c1/url')
+        GroupMeta.objects.create(group=self.open, key='trello:tid', value='c2/url')
+
+    def tearDown(self):
+        unregister(self.plugin_cls)
+        super(SyncCardStatusTest, self).tearDown()
+
+    @fixture
+    def plugin(self):
+        return self.plugin_cls()
+
+    @responses.activate
+    def test_first_run_checks_cards_in_batch(self):
+        responses.add(responses.GET, 'https://trello.com/1/batch', json=[
+            {'200': {'id': 'c1', 'idBoard': 'b1', 'closed': False, 'list': {'name': 'Done'}}},
+            {'200': {'id': 'c2', 'idBoard': 'b1', 'closed': False, 'list': {'name': 'Todo'}}},
+        ])
+
+        assert sync_card_status(self.plugin, self.project) == [self.done.id]
+        assert len(responses.calls) == 1
+        assert self.done.__class__.objects.get(id=self.done.id).status == GroupStatus.RESOLVED
+        assert self.open.__class__.objects.get(id=self.open.id).status == GroupStatus.UNRESOLVED
+        assert self.plugin.get_option('sync_checkpoint', self.project)
+        assert Activity.objects.filter(
+            group=self.done, type=Activity.SET_RESOLVED).count() == 1
+        assert not Activity.objects.filter(group=self.open).exists()
+
+    @responses.activate
+    def test_checkpoint_survives_the_batch_route(self):
+        responses.add(responses.GET, 'https://trello.com/1/batch', json=[
+            {'200': {'id': 'c1', 'idBoard': 'b1', 'closed': False, 'list': {'name': 'Todo'}}},
+            {'200': {'id': 'c2', 'idBoard': 'b1', 'closed': False, 'list': {'name': 'Todo'}}},
+        ])
+        sync_card_status(self.plugin, self.project)
+        checkpoint = self.plugin.get_option('sync_checkpoint', self.project)
+
+        responses.reset()
+        responses.add(responses.GET, 'https://trello.com/1/batch', json=[{'200': []}])
+        sync_card_status(self.plugin, self.project)
+
+        # decode the outer urls param, then the actions route inside it,
+        # the way Trello does
+        urls = parse_qs(urlparse(responses.calls[0].request.url).query)['urls'][0]
+        route = urlparse(urls.split(',')[0].replace('%2C', ','))
+        assert parse_qs(route.query)['since'] == [checkpoint]
+
+    @responses.activate
+    def test_later_runs_only_read_board_actions(self):
+        self.plugin.set_option('sync_checkpoint', '2018-01-01T00:00:00', self.project)
+        cache.set_many({
+            'trello:card-board:c1': 'b1',
+            'trello:card-board:c2': 'b1',
+        })
+        responses.add(responses.GET, 'https://trello.com/1/batch', json=[
+            {'200': [
+                {'data': {'card': {'id': 'c2', 'closed': True}}},
+            ]},
+        ])
+
+        assert sync_card_status(self.plugin, self.project) == [self.open.id]
+        assert len(responses.calls) == 1
+        assert '/boards/b1/actions' in responses.calls[0].request.url
+
+    @responses.activate
+    def test_keeps_checkpoint_when_board_actions_fail(self):
+        self.plugin.set_option('sync_checkpoint', '2018-01-01T00:00:00', self.project)
+        cache.set_many({
+            'trello:card-board:c1': 'b1',
+            'trello:card-board:c2': 'b1',
+        })
+        responses.add(responses.GET, 'https://trello.com/1/batch', json=[
+            {'429': {'message': 'API_TOKEN_LIMIT_EXCEEDED'}},
+        ])
+
+        assert sync_card_status(self.plugin, self.project) == []
+        assert self.plugin.get_option('sync_checkpoint', self.project) == '2018-01-01T00:00:00'
+
+    @responses.activate
+    def test_checks_cards_of_truncated_boards_in_full(self):
+        self.plugin.set_option('sync_checkpoint', '2018-01-01T00:00:00', self.project)
+        cache.set_many({
+            'trello:card-board:c1': 'b1',
+            'trello:card-board:c2': 'b1',
+        })
+        responses.add(responses.GET, 'https://trello.com/1/batch', json=[
+            {'200': [{'data': {'card': {'id': 'other', 'closed': True}}}] * ACTIONS_LIMIT},
+        ])
+
+        sync_card_status(self.plugin, self.project)
+        assert cache.get('trello:card-board:c1') is None
+        assert cache.get('trello:card-board:c2') is None
@@ -0,0 +1,92 @@
+from __future__ import absolute_import
+
+import responses
+
+from django.core.cache import cache
+from exam import fixture
+from mock import patch
+from sentry.models import GroupMeta
+from sentry.plugins import register, unregister
+from sentry.testutils import TestCase
+
+from sentry_trello.plugin import TrelloCard
+from sentry_trello.updates import MAX_FLUSH_ATTEMPTS, flush_updates, record_event
+
+
+class CardUpdatesTest(TestCase):
+    plugin_cls = TrelloCard
+
+    def setUp(self):
+        super(CardUpdatesTest, self).setUp()
+        register(self.plugin_cls)
+        cache.clear()
+        self.plugin.set_option('key', 'foo', self.project)
+        self.plugin.set_option('token', 'bar', self.project)
+        self.group = self.create_group(message='Hello world', culprit='foo.bar')
+        self.event = self.create_event(group=self.group, message='Hello world')
+
+    def tearDown(self):
+        unregister(self.plugin_cls)
+        super(CardUpdatesTest, self).tearDown()
+
+    @fixture
+    def plugin(self):
+        return self.plugin_cls()
+
+    @patch('sentry_trello.updates.create_card.delay')
+    def test_creates_card_for_new_group(self, create_card):
+        self.plugin.set_option('auto_list', '15', self.project)
+        record_event(self.plugin, self.group, self.event)
+        record_event(self.plugin, self.group, self.event)
+
+        assert create_card.call_count == 1
+        assert create_card.call_args[1]['form_data']['trello_list'] == '15'
+        meta = GroupMeta.objects.get(group=self.group, key='trello:tid')
+        assert meta.value == 'pending/auto'
+
+    @responses.activate
+    @patch('sentry_trello.updates.flush_card_update.apply_async')
+    def test_aggregates_events_into_one_comment(self, apply_async):
+        responses.add(responses.POST, 'https://trello.com/1/cards/2/actions/comments',
+                      json={'id': '3'})
+        GroupMeta.objects.create(group=self.group, key='trello:tid', value='2/url')
+
+        for _ in range(3):
+            record_event(self.plugin, self.group, self.event)
+
+        assert apply_async.call_count == 1
+        flush_updates(self.plugin, self.group, apply_async.call_args[1]['kwargs']['bucket'])
+
+        assert len(responses.calls) == 1
+        assert 'Seen 3 more times' in responses.calls[0].request.body
+
+    @responses.activate
+    @patch('sentry_trello.updates.flush_card_update.apply_async')
+    def test_lists_each_release_once(self, apply_async):
+        responses.add(responses.POST, 'https://trello.com/1/cards/2/actions/comments',
+                      json={'id': '3'})
+        GroupMeta.objects.create(group=self.group, key='trello:tid', value='2/url')
+
+        for release in ('1.0', '2.0', '1.0'):
+            with patch.object(self.event, 'get_tag', return_value=release):
+                record_event(self.plugin, self.group, self.event)
+        flush_updates(self.plugin, self.group, apply_async.call_args[1]['kwargs']['bucket'])
+
+        assert 'Releases: 1.0, 2.0' in responses.calls[0].request.body
+
+    @patch('sentry_trello.updates.create_card.delay')
+    def test_only_one_card_per_new_group(self, create_card):
+        # another process already claimed the group but has not linked it yet
+        cache.add('trello:auto-create:%s' % self.group.id, 1)
+        record_event(self.plugin, self.group, self.event)
+        assert create_card.call_count == 0
+
+    @patch('sentry_trello.updates.flush_card_update.apply_async')
+    def test_stops_waiting_for_pending_card(self, apply_async):
+        GroupMeta.objects.create(group=self.group, key='trello:tid', value='pending/auto')
+        flush_updates(self.plugin, self.group, 1)
+        assert apply_async.call_args[1]['kwargs']['attempt'] == 1
+
+        apply_async.reset_mock()
+        flush_updates(self.plugin, self.group, 1, attempt=MAX_FLUSH_ATTEMPTS - 1)
+        assert apply_async.call_count == 0
@@ -0,0 +1,100 @@
+from __future__ import absolute_import
+
+import base64
+import hmac
+import responses
+
+from django.core.urlresolvers import reverse
+from hashlib import sha1
+from exam import fixture
+from sentry.plugins import register, unregister
+from sentry.testutils import TestCase
+from sentry.utils import json
+from sentry.utils.http import absolute_uri
+
+from sentry_trello.client import get_metadata_cache
+from sentry_trello.plugin import TrelloCard
+
+
+class TrelloWebhookViewTest(TestCase):
+    plugin_cls = TrelloCard
+
+    def setUp(self):
+        super(TrelloWebhookViewTest, self).setUp()
+        register(self.plugin_cls)
+        get_metadata_cache().clear()
+        self.plugin.set_option('key', 'foo', self.project)
+        self.plugin.set_option('token', 'bar', self.project)
+        self.plugin.set_option('webhook_board:1', True, self.project)
+        self.plugin.set_option('webhook_secret', 'secret', self.project)
+
+    def tearDown(self):
+        unregister(self.plugin_cls)
+        super(TrelloWebhookViewTest, self).tearDown()
+
+    @fixture
+    def plugin(self):
+        return self.plugin_cls()
+
+    @fixture
+    def path(self):
+        return reverse('sentry-plugins-trello-webhook', args=[self.project.id])
+
+    def post(self, payload):
+        body = json.dumps(payload)
+        signature = base64.b64encode(hmac.new(
+            b'secret', body.encode('utf-8') + absolute_uri(self.path).encode('utf-8'), sha1,
+        ).digest())
+        return self.client.post(self.path, body, content_type='application/json',
+                                HTTP_X_TRELLO_WEBHOOK=signature)
+
+    def test_head(self):
+        response = self.client.head(self.path)
+        assert response.status_code == 200
+
+    @responses.activate
+    def test_invalidates_board_lists(self):
+        responses.add(responses.GET, 'https://trello.com/1/boards/1/lists',
+                      json=[{'id': '15', 'name': 'Todo'}])
+        trello = self.plugin.get_client(self.project)
+        trello.get_board_list('1', fields='name')
+        trello.get_board_list('1', fields='name')
+        assert len(responses.calls) == 1
+
+        response = self.post({
+            'model': {'id': '1'},
+            'action': {'type': 'updateList', 'data': {'board': {'id': '1'}}},
+        })
+        assert response.status_code == 200
+
+        trello.get_board_list('1', fields='name')
+        assert len(responses.calls) == 2
+
+    def test_unknown_board(self):
+        response = self.post({
+            'model': {'id': '2'},
+            'action': {'type': 'updateList'},
+        })
+        assert response.status_code == 410
+
+    def test_ignores_missing_boards(self):
+        response = self.post({
+            'model': {'id': '1'},
+            'action': {'type': 'updateList', 'data': {'board': None, 'boardSource': {}}},
+        })
+        assert response.status_code == 200
+
+    def test_rejects_unsigned_calls_without_secret(self):
+        self.plugin.set_option('webhook_secret', '', self.project)
+        response = self.client.post(self.path, json.dumps({
+            'model': {'id': '1'},
+            'action': {'type': 'updateList'},
+        }), content_type='application/json')
+        assert response.status_code == 401
+
+    def test_rejects_bad_signature(self):
+        response = self.client.post(self.path, json.dumps({
+            'model': {'id': '1'},
+            'action': {'type': 'updateList'},
+        }), content_type='application/json', HTTP_X_TRELLO_WEBHOOK='nope')
+        assert response.status_code == 401